@@ -0,0 +1,273 @@
+"""
+BM25 document store module for HRAsk system - indexed BM25 retrieval
+"""
+import os
+import json
+import hashlib
+import math
+import logging
+from collections import Counter
+from typing import Dict, Any, List, Optional
+import numpy as np
+from haystack import Document
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+from haystack.document_stores.in_memory.document_store import BM25_SCALING_FACTOR, BM25DocumentStats
+from haystack.document_stores.types import DuplicatePolicy
+from haystack.utils import expit
+
+logger = logging.getLogger(__name__)
+
+def document_id(source: str, row_id: Any, content: str) -> str:
+    """
+    Deterministic document ID from the source, row and content, so
+    re-ingesting the same rows produces the same IDs
+    """
+    return hashlib.blake2b(f"{source}|{row_id}|{content}".encode(), digest_size=16).hexdigest()
+
+class BM25DocumentStore(InMemoryDocumentStore):
+    """
+    InMemoryDocumentStore that keeps per-token postings up to date on every
+    write/delete, so BM25L retrieval scores the corpus with a few NumPy
+    operations per query token instead of a Python loop over every document.
+    Scores and ordering match InMemoryDocumentStore.bm25_retrieval.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Row bookkeeping in storage order; deleted rows are retired, and compacted
+        # away once they outnumber the live ones
+        self._row_ids: List[Optional[str]] = []
+        self._row_of: Dict[str, int] = {}
+        self._doc_lens: List[int] = []
+        self._has_content: List[bool] = []
+        # token -> ([rows], [term frequencies])
+        self._postings: Dict[str, tuple] = {}
+        # token -> (rows array, term frequencies array), dropped when the token's postings grow
+        self._posting_arrays: Dict[str, tuple] = {}
+        self._arrays = None
+
+    def write_documents(self, documents: List[Document], policy: DuplicatePolicy = DuplicatePolicy.NONE) -> int:
+        """Write documents and add the ones actually stored to the postings"""
+        try:
+            return super().write_documents(documents, policy)
+        finally:
+            for document in documents:
+                # Skipped duplicates leave the previously stored document in place
+                if document.id not in self._row_of and self.storage.get(document.id) is document:
+                    self._index_document(document)
+
+    def delete_documents(self, document_ids: List[str]) -> None:
+        """Delete documents and retire their rows"""
+        super().delete_documents(document_ids)
+        for doc_id in document_ids:
+            row = self._row_of.pop(doc_id, None)
+            if row is not None:
+                self._row_ids[row] = None
+                self._arrays = None
+
+        if len(self._row_ids) - len(self._row_of) > len(self._row_of):
+            self._compact()
+
+    def tfidf_vector(self, doc_id: str) -> Dict[str, float]:
+        """TF-IDF weights of a stored document's tokens, for comparing documents with each other"""
+        stats = self._bm25_attr[doc_id]
+        n_corpus = len(self._bm25_attr)
+        return {
+            token: freq * math.log((n_corpus + 1.0) / (self._freq_vocab_for_idf[token] + 0.5))
+            for token, freq in stats.freq_token.items()
+        }
+
+    def save_index(self, path: str) -> None:
+        """
+        Save documents and their token statistics to an .npz file so the
+        index can be restored without re-tokenizing the corpus
+        """
+        documents = list(self.storage.values())
+        vocab = {}
+        indptr = [0]
+        indices = []
+        freqs = []
+        doc_lens = []
+
+        for document in documents:
+            stats = self._bm25_attr[document.id]
+            for token, freq in stats.freq_token.items():
+                indices.append(vocab.setdefault(token, len(vocab)))
+                freqs.append(freq)
+            indptr.append(len(indices))
+            doc_lens.append(stats.doc_len)
+
+        # Write to a temporary file first so readers never see a partial cache
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as file:
+            np.savez(
+                file,
+                documents=np.array([json.dumps(doc.to_dict()) for doc in documents], dtype=str),
+                tokens=np.array(list(vocab), dtype=str),
+                indptr=np.asarray(indptr, dtype=np.int64),
+                indices=np.asarray(indices, dtype=np.int64),
+                freqs=np.asarray(freqs, dtype=np.int64),
+                doc_lens=np.asarray(doc_lens, dtype=np.int64),
+                avg_doc_len=np.float64(self._avg_doc_len)
+            )
+        os.replace(tmp_path, path)
+        logger.info(f"Saved BM25 index with {len(documents)} documents to {path}")
+
+    def load_index(self, path: str) -> int:
+        """
+        Load documents and token statistics saved by save_index, replacing
+        the current contents of the store
+        """
+        with np.load(path) as data:
+            documents = [Document.from_dict(json.loads(doc)) for doc in data["documents"]]
+            tokens = data["tokens"].tolist()
+            indptr = data["indptr"]
+            indices = data["indices"]
+            freqs = data["freqs"]
+            doc_lens = data["doc_lens"].tolist()
+            avg_doc_len = float(data["avg_doc_len"])
+
+        if self.storage:
+            self.delete_documents(list(self.storage.keys()))
+
+        vocab_freq = Counter()
+        for i, document in enumerate(documents):
+            start, end = indptr[i], indptr[i + 1]
+            freq_token = Counter(dict(zip((tokens[j] for j in indices[start:end]), freqs[start:end].tolist())))
+            vocab_freq.update(freq_token.keys())
+
+            self.storage[document.id] = document
+            self._bm25_attr[document.id] = BM25DocumentStats(freq_token, doc_lens[i])
+            self._index_document(document)
+
+        self._freq_vocab_for_idf.update(vocab_freq)
+        self._avg_doc_len = avg_doc_len
+
+        logger.info(f"Loaded BM25 index with {len(documents)} documents from {path}")
+        return len(documents)
+
+    def _compact(self) -> None:
+        """Rebuild the rows and postings from the stored documents, dropping retired rows"""
+        self._row_ids = []
+        self._row_of = {}
+        self._doc_lens = []
+        self._has_content = []
+        self._postings = {}
+        self._posting_arrays = {}
+
+        for document in self.storage.values():
+            self._index_document(document)
+
+        self._arrays = None
+
+    def _index_document(self, document: Document) -> None:
+        """Append the document's token frequencies to the postings"""
+        row = len(self._row_ids)
+        stats = self._bm25_attr[document.id]
+
+        self._row_ids.append(document.id)
+        self._row_of[document.id] = row
+        self._doc_lens.append(stats.doc_len)
+        self._has_content.append(document.content is not None)
+
+        for token, freq in stats.freq_token.items():
+            rows, freqs = self._postings.setdefault(token, ([], []))
+            rows.append(row)
+            freqs.append(freq)
+            self._posting_arrays.pop(token, None)
+
+        self._arrays = None
+
+    def _row_arrays(self) -> tuple:
+        """Document lengths and live-row mask as arrays, rebuilt only after writes/deletes"""
+        if self._arrays is None:
+            doc_lens = np.asarray(self._doc_lens, dtype=np.float64)
+            live = np.fromiter((doc_id is not None for doc_id in self._row_ids), dtype=bool, count=len(self._row_ids))
+            self._arrays = (doc_lens, live & np.asarray(self._has_content, dtype=bool))
+        return self._arrays
+
+    def _posting_array(self, token: str) -> tuple:
+        """A token's postings as arrays, converted once per change instead of once per query"""
+        arrays = self._posting_arrays.get(token)
+        if arrays is None:
+            rows, freqs = self._postings[token]
+            arrays = self._posting_arrays[token] = (np.asarray(rows, dtype=np.intp), np.asarray(freqs, dtype=np.float64))
+        return arrays
+
+    def bm25_retrieval(self, query: str, filters: Optional[Dict[str, Any]] = None, top_k: int = 10,
+                       scale_score: bool = False) -> List[Document]:
+        """
+        Retrieve the top_k documents for the query using the postings
+        """
+        if self.bm25_algorithm != "BM25L":
+            return super().bm25_retrieval(query=query, filters=filters, top_k=top_k, scale_score=scale_score)
+
+        if not query:
+            raise ValueError("Query should be a non-empty string")
+
+        doc_lens, candidates = self._row_arrays()
+
+        if filters:
+            if "operator" not in filters:
+                raise ValueError(
+                    "Invalid filter syntax. See https://docs.haystack.deepset.ai/docs/metadata-filtering for details."
+                )
+            allowed = np.zeros(len(self._row_ids), dtype=bool)
+            allowed[[self._row_of[doc.id] for doc in self.filter_documents(filters=filters)]] = True
+            candidates = candidates & allowed
+
+        rows = np.flatnonzero(candidates)
+        if len(rows) == 0:
+            logger.info("No documents found for BM25 retrieval. Returning empty list.")
+            return []
+
+        k = self.bm25_parameters.get("k1", 1.5)
+        b = self.bm25_parameters.get("b", 0.75)
+        delta = self.bm25_parameters.get("delta", 0.5)
+        n_corpus = len(self._bm25_attr)
+
+        # Per-document length normalisation, shared by every query token
+        norm = 1 - b + b * doc_lens / self._avg_doc_len
+        absent_tf = (1.0 + k) * (0.0 + delta) / (k + 0.0 + delta)
+
+        scores = np.zeros(len(self._row_ids))
+        for token in dict.fromkeys(self._tokenize_bm25(query)):
+            n = self._freq_vocab_for_idf.get(token, 0)
+            if n == 0:
+                continue
+            idf = math.log((n_corpus + 1.0) / (n + 0.5))
+
+            term = np.full(len(self._row_ids), absent_tf)
+            token_rows, freqs = self._posting_array(token)
+            ctd = freqs / norm[token_rows]
+            term[token_rows] = (1.0 + k) * (ctd + delta) / (k + ctd + delta)
+            scores += idf * term
+
+        candidate_scores = scores[rows]
+        if top_k < len(rows):
+            # Only rows scoring at least the k-th best (ties included) can make the cut
+            kth = np.partition(candidate_scores, len(rows) - top_k)[len(rows) - top_k]
+            keep = candidate_scores >= kth
+            rows, candidate_scores = rows[keep], candidate_scores[keep]
+
+        # Stable sort keeps storage order between equal scores, like sorted() in the base store
+        ranked = rows[np.argsort(-candidate_scores, kind="stable")[:top_k]]
+
+        documents = []
+        for row in ranked:
+            score = float(scores[row])
+            if scale_score:
+                score = expit(score / BM25_SCALING_FACTOR)
+
+            # BM25L scores are never meaningfully negative
+            if score <= 0.0:
+                continue
+
+            doc_fields = self.storage[self._row_ids[row]].to_dict()
+            doc_fields["score"] = score
+            if not self.return_embedding and "embedding" in doc_fields:
+                doc_fields.pop("embedding")
+
+            documents.append(Document.from_dict(doc_fields))
+
+        return documents
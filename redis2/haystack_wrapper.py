@@ -4,19 +4,40 @@ Haystack wrapper module for HRAsk system - integration with Haystack
 import os
 import logging
 from typing import Dict, Any, List, Optional, Union
-from haystack.document_stores.in_memory import InMemoryDocumentStore
 from haystack.components.retrievers.in_memory import InMemoryBM25Retriever
 from haystack import Document
-import pandas as pd
+import pyarrow.csv as pacsv
 import asyncio
+import orjson
+from cachetools import TTLCache
+
+from bm25_store import BM25DocumentStore, document_id
 
 logger = logging.getLogger(__name__)
 
+# Lowercased copies of the columns role filters compare case-insensitively, by lowercased column name
+_KEY_FIELDS = {"employee": "employee_key", "location": "location_key"}
+
+def _data_type_for(file_path: str) -> str:
+    """Data type of a CSV's rows from its file name, as the ingestion API classifies uploads"""
+    name = os.path.basename(file_path).lower()
+    if "dailysalesbreakdown" in name or "sales" in name:
+        return "sales_breakdown"
+    elif "file1" in name or "employee" in name or "schedule" in name:
+        return "employee_schedule"
+    return "generic"
+
 class HaystackWrapper:
     def __init__(self):
         """Initialize Haystack document store and retriever"""
-        self.document_store = InMemoryDocumentStore()
+        self.document_store = BM25DocumentStore()
         self.retriever = InMemoryBM25Retriever(document_store=self.document_store)
+        
+        # Retrieved documents by (query, filters, top_k), cleared whenever the store changes
+        self.retrieval_cache = TTLCache(
+            maxsize=int(os.getenv('RETRIEVAL_CACHE_SIZE', 512)),
+            ttl=int(os.getenv('RETRIEVAL_CACHE_TTL', 300))
+        )
         logger.info("Haystack components initialized")
     
     async def retrieve_documents(self, query: str, filters: Dict[str, Any] = None, 
@@ -25,6 +46,17 @@ class HaystackWrapper:
         Retrieve documents from Haystack using the query
         """
         try:
+            # BM25 tokenization is case-insensitive, so queries differing only in case share an entry
+            cache_key = (
+                query.strip().lower(),
+                orjson.dumps(filters, option=orjson.OPT_SORT_KEYS) if filters else b"",
+                top_k
+            )
+            cached = self.retrieval_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Retrieved %d cached documents for query: %.50s...", len(cached), query)
+                return list(cached)
+            
             # Retriever.run() is synchronous, so we run it in an executor to avoid blocking
             loop = asyncio.get_running_loop()
             result = await loop.run_in_executor(
@@ -32,10 +64,11 @@ class HaystackWrapper:
                 lambda: self.retriever.run(query=query, filters=filters, top_k=top_k)
             )
             documents = result["documents"]
-            logger.info(f"Retrieved {len(documents)} documents for query: {query[:50]}...")
+            self.retrieval_cache[cache_key] = list(documents)
+            logger.info("Retrieved %d documents for query: %.50s...", len(documents), query)
             return documents
         except Exception as e:
-            logger.error(f"Error retrieving documents: {str(e)}")
+            logger.error("Error retrieving documents: %s", e)
             return []
     
     def add_documents(self, documents: List[Document]) -> int:
@@ -43,11 +76,26 @@ class HaystackWrapper:
         Add documents to Haystack document store
         """
         try:
-            self.document_store.write_documents(documents)
-            logger.info(f"Added {len(documents)} documents to document store")
-            return len(documents)
+            # Skip documents already stored, or repeated within the batch
+            new_docs = {}
+            for doc in documents:
+                if doc.id not in self.document_store.storage:
+                    new_docs.setdefault(doc.id, doc)
+            
+            if new_docs:
+                # Lowercased copies of the fields role filters compare case-insensitively,
+                # whatever the case of the column they came from (file1.csv has 'Employee')
+                for doc in new_docs.values():
+                    for field, value in list(doc.meta.items()):
+                        key_field = _KEY_FIELDS.get(str(field).strip().lower())
+                        if key_field and value is not None:
+                            doc.meta[key_field] = str(value).lower()
+                self.document_store.write_documents(list(new_docs.values()))
+                self.retrieval_cache.clear()
+            logger.info("Added %d documents to document store, skipped %d existing", len(new_docs), len(documents) - len(new_docs))
+            return len(new_docs)
         except Exception as e:
-            logger.error(f"Error adding documents: {str(e)}")
+            logger.error("Error adding documents: %s", e)
             return 0
     
     async def ingest_csv(self, file_path: str) -> int:
@@ -56,26 +104,43 @@ class HaystackWrapper:
         This is a wrapper around the existing functionality to make it async-compatible
         """
         try:
-            # Reading CSV is I/O bound, so we run it in an executor
+            # Arrow parses the file in parallel blocks, off the event loop
             loop = asyncio.get_running_loop()
-            df = await loop.run_in_executor(None, pd.read_csv, file_path)
+            table = await loop.run_in_executor(
+                None,
+                lambda: pacsv.read_csv(
+                    file_path,
+                    read_options=pacsv.ReadOptions(block_size=8 << 20, use_threads=True),
+                    # Empty cells are missing values, as with pandas
+                    convert_options=pacsv.ConvertOptions(strings_can_be_null=True)
+                )
+            )
+            
+            # Name blank headers like pandas does, so no column is lost in the row dicts
+            table = table.rename_columns([name or f"Unnamed: {i}" for i, name in enumerate(table.column_names)])
+            
+            # Role filters let every role see sales data, so the file's data type goes in each document
+            data_type = _data_type_for(file_path)
             
             docs = []
-            for idx, row in df.iterrows():
-                # Create content from CSV row
-                content_parts = []
-                meta_data = {"source": "csv", "row_id": idx}
-                
-                for col, val in row.items():
-                    if pd.notna(val):
-                        content_parts.append(f"{col}: {val}")
-                        meta_data[col] = str(val)
-                
-                content = "\n".join(content_parts)
-                
-                # Create document
-                doc = Document(content=content, meta=meta_data)
-                docs.append(doc)
+            idx = 0
+            for batch in table.to_batches(max_chunksize=10_000):
+                for row in batch.to_pylist():
+                    # Create content from CSV row
+                    content_parts = []
+                    meta_data = {"source": "csv", "data_type": data_type, "row_id": idx}
+                    
+                    for col, val in row.items():
+                        if val is not None:
+                            content_parts.append(f"{col}: {val}")
+                            meta_data[col] = str(val)
+                    
+                    content = "\n".join(content_parts)
+                    
+                    # Create document
+                    doc = Document(id=document_id("csv", idx, content), content=content, meta=meta_data)
+                    docs.append(doc)
+                    idx += 1
             
             # Adding to document store
             added = self.add_documents(docs)
@@ -83,23 +148,24 @@ class HaystackWrapper:
             return added
             
         except Exception as e:
-            logger.error(f"Error ingesting CSV: {str(e)}")
+            logger.error("Error ingesting CSV: %s", e)
             return 0
     
     def get_document_count(self) -> int:
         """Get the number of documents in the document store"""
         try:
-            return len(self.document_store.filter_documents())
+            return self.document_store.count_documents()
         except Exception as e:
-            logger.error(f"Error getting document count: {str(e)}")
+            logger.error("Error getting document count: %s", e)
             return 0
     
     def clear_documents(self) -> bool:
         """Clear all documents from the document store"""
         try:
             self.document_store.delete_documents()
+            self.retrieval_cache.clear()
             logger.info("Document store cleared")
             return True
         except Exception as e:
-            logger.error(f"Error clearing documents: {str(e)}")
+            logger.error("Error clearing documents: %s", e)
             return False
\ No newline at end of file
@@ -1,33 +1,113 @@
 """
 HR Ask Service - Processes questions from Redis queue using Haystack v2 and Ollama
 """
-import json
+import asyncio
+import hashlib
 import logging
 import os
-import time
-from typing import Dict, Any, Optional
-import redis
-import requests
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, AsyncIterator, Callable, Optional
+import httpx
+import orjson
+from cachetools import TTLCache
 from haystack import Document
-from haystack.document_stores.in_memory import InMemoryDocumentStore
 from haystack.components.retrievers.in_memory import InMemoryBM25Retriever
+from haystack.document_stores.types import DuplicatePolicy
 import pandas as pd
 
+from bm25_store import BM25DocumentStore, document_id
+from redis_client import RedisAsyncClient
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Bumped when the stored document format changes, so older index caches are rebuilt
+_INDEX_VERSION = 2
+
+# Roles whose documents are restricted by retriever filters, or not at all
+_RESTRICTED_ROLES = {"employee"}
+_UNRESTRICTED_ROLES = {"admin", "supervisor", "manager"}
+
+# Role-specific prompt context, formatted with the user ID
+_ROLE_TEMPLATES = {
+    "employee": "You're answering for an employee (ID: {0}). Only provide information relevant to this specific employee.",
+    "supervisor": "You're answering for a supervisor (ID: {0}). Provide team-level information for their supervised employees.",
+    "manager": "You're answering for a manager (ID: {0}). Provide location-level performance and team data.",
+    "admin": "You're answering for an administrator. Provide comprehensive information as requested."
+}
+
+# Prompt around the retrieved context and the question
+_PROMPT_PREFIX = "Answer briefly using only this data:\n\n"
+_PROMPT_QUESTION = "\n\nQ: "
+_PROMPT_ANSWER = "\nA:"
+
+# Columns in document content: sales, cost and variance data, and the
+# scheduled, attendance and hour difference details of a shift
+_SALES_CONTENT_COLS = ('Date', 'Sales-Projected NET SALES', 'Threshold Ratio',
+                       'Scheduled Cost ', 'Scheduled Threshold', 'Attendance Cost ', 'Attendance Threshold',
+                       'Cost   Variance', 'Threshold  Variance')
+_EMPLOYEE_DETAIL_COLS = ('Sched Position', 'Sched Department', 'Sched Start', 'Sched End', 'Sched Total hrs',
+                         'Att Position', 'Att Department', 'Att Start', 'Att End', 'Att Total hrs',
+                         'Hour Difference')
+
+# Stop sequences for Ollama generation
+_LLM_STOP_TOKENS = ["Q:", "A:", "\n"]
+
+def _stringify_records(df: pd.DataFrame) -> list:
+    """Convert each row to a dict of its non-null values as strings, in one pass over the cells"""
+    cols = list(df.columns)
+    # val != val is the NaN check, without per-cell pandas overhead
+    return [
+        {col: str(val) for col, val in zip(cols, row) if val is not None and val == val}
+        for row in df.to_numpy(dtype=object)
+    ]
+
+def _join_record(record: Dict[str, str], cols: tuple) -> str:
+    """Build the "col: value" content of a row from the given columns it has values for"""
+    return "\n".join([f"{col}: {record[col]}" for col in cols if col in record])
+
+def _column_as_str(df: pd.DataFrame, col: str) -> list:
+    """Column values as strings, or empty strings when the column is missing"""
+    if col not in df.columns:
+        return [""] * len(df)
+    return df[col].map(str).tolist()
+
+def _cosine(a: Dict[str, float], b: Dict[str, float]) -> float:
+    """Cosine similarity of two sparse term-weight vectors"""
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(weight * b[token] for token, weight in a.items() if token in b)
+    if not dot:
+        return 0.0
+    norm_a = sum(weight * weight for weight in a.values()) ** 0.5
+    norm_b = sum(weight * weight for weight in b.values()) ** 0.5
+    return dot / (norm_a * norm_b)
+
+def _next_chunk(chunks, convert: Optional[Callable] = None, source_file: str = "") -> Any:
+    """
+    Read the next CSV chunk, converted to documents when convert is given;
+    None once the file is done. Runs in a thread, off the event loop
+    """
+    df = next(chunks, None)
+    if df is None or convert is None:
+        return df
+    return convert(df, source_file)
+
+def _process_chunk_worker(task: tuple) -> list:
+    """Convert one CSV chunk to Haystack documents in a worker process"""
+    df, source_file, processor_name = task
+    return getattr(HRProcessor, processor_name)(df, source_file)
+
 class HRProcessor:
     def __init__(self):
-        # Redis connection
-        self.redis_client = redis.Redis(
-            host=os.getenv('REDIS_HOST', 'redis'),
-            port=int(os.getenv('REDIS_PORT', 6379)),
-            decode_responses=True
-        )
+        # Redis connection; questions are read from the ask stream through its consumer group
+        self.redis_client = RedisAsyncClient()
         
-        # Document store - using InMemory for simplicity (can switch to Elasticsearch later)
-        self.document_store = InMemoryDocumentStore()
+        # Document store - in-memory with indexed BM25 (can switch to Elasticsearch later)
+        self.document_store = BM25DocumentStore()
         self.retriever = InMemoryBM25Retriever(document_store=self.document_store)
         
         # Ollama connection
@@ -35,215 +115,284 @@ class HRProcessor:
         self.ollama_port = os.getenv('OLLAMA_PORT', '11434')
         self.ollama_base_url = f"http://{self.ollama_host}:{self.ollama_port}"
         
-        # Queue names
-        self.ask_queue = "hrask.ask.queue"
-        self.response_queue = "hrask.response.queue"
+        # Pooled HTTP client so requests to Ollama reuse keep-alive connections
+        self.http_client = httpx.AsyncClient(
+            base_url=self.ollama_base_url,
+            timeout=100,
+            limits=httpx.Limits(max_keepalive_connections=16)
+        )
+        
+        # Rows per CSV chunk, and so documents per write_documents call
+        self.ingest_batch_size = int(os.getenv('INGEST_BATCH_SIZE', 1000))
+        
+        # Worker processes for CSV conversion (0 or 1 processes inline)
+        self.ingest_workers = int(os.getenv('INGEST_PARALLEL_WORKERS', 0))
+        
+        # LLM responses by (query, context hash, role), expired so re-ingested data is picked up
+        self.response_cache = TTLCache(
+            maxsize=int(os.getenv('LLM_CACHE_SIZE', 1024)),
+            ttl=int(os.getenv('LLM_CACHE_TTL', 900))
+        )
+        
+        # Re-check retrieved documents against the role after the retriever filters
+        self.role_postfilter = os.getenv('ROLE_POSTFILTER', 'false').lower() == 'true'
+        
+        # Source CSV files and the on-disk BM25 index built from them
+        self.data_dir = "/app/data"
+        self.csv_files = ["dailySalesBreakdown.csv", "file1.csv"]
+        self.index_cache_dir = os.getenv('BM25_CACHE_DIR', os.path.join(self.data_dir, ".bm25_cache"))
+        
+        # Ingest writes to the store from a thread; retrieval holds the lock so it never sees a partial write
+        self.store_lock = threading.Lock()
+        
+        # Set once the first documents are searchable; queries wait up to ready_timeout seconds for it
+        self.ready = asyncio.Event()
+        self.ready_timeout = float(os.getenv('READY_TIMEOUT', 2))
         
         logger.info("HR Processor initialized")
 
-    def ingest_csv_files(self):
-        """Ingest CSV files from the data directory"""
-        data_dir = "/app/data"
-        csv_files = ["dailySalesBreakdown.csv", "file1.csv"]
+    async def load_or_ingest_csv_files(self) -> int:
+        """Load the cached BM25 index for the current CSV files, or ingest them and cache the result"""
+        cache_path = self._index_cache_path()
         
-        all_docs = []
+        if os.path.exists(cache_path):
+            try:
+                total_docs = await asyncio.to_thread(self._locked, self.document_store.load_index, cache_path)
+                self.ready.set()
+                return total_docs
+            except Exception as e:
+                logger.error("Error loading index cache, re-ingesting: %s", e)
         
-        for csv_file in csv_files:
-            file_path = os.path.join(data_dir, csv_file)
-            if os.path.exists(file_path):
-                logger.info(f"Ingesting {csv_file}")
-                docs = self._process_csv_file(file_path, csv_file)
-                all_docs.extend(docs)
-            else:
-                logger.warning(f"File not found: {file_path}")
+        total_docs = await self.ingest_csv_files()
         
-        if all_docs:
-            self.document_store.write_documents(all_docs)
-            logger.info(f"Ingested {len(all_docs)} documents")
+        try:
+            os.makedirs(self.index_cache_dir, exist_ok=True)
+            await asyncio.to_thread(self._locked, self.document_store.save_index, cache_path)
+        except Exception as e:
+            logger.error("Error saving index cache: %s", e)
         
-        return len(all_docs)
+        return total_docs
 
-    def _process_csv_file(self, file_path: str, source_file: str) -> list:
-        """Process a CSV file and convert to Haystack documents"""
-        df = pd.read_csv(file_path)
-        docs = []
+    def _locked(self, fn: Callable, *args) -> Any:
+        """Call fn while holding the store lock, for store access from worker threads"""
+        with self.store_lock:
+            return fn(*args)
+
+    def _index_cache_path(self) -> str:
+        """Cache file keyed by the name, mtime and size of each CSV file"""
+        signature = [f"v{_INDEX_VERSION}"]
+        for csv_file in self.csv_files:
+            file_path = os.path.join(self.data_dir, csv_file)
+            if os.path.exists(file_path):
+                signature.append(f"{csv_file}:{os.path.getmtime(file_path)}:{os.path.getsize(file_path)}")
+        
+        digest = hashlib.sha256("|".join(signature).encode()).hexdigest()
+        return os.path.join(self.index_cache_dir, f"{digest}.npz")
+
+    async def ingest_csv_files(self):
+        """
+        Ingest CSV files from the data directory, marking the processor ready
+        after the first chunk. Reading, converting and writing run off the
+        event loop, so queries are answered while ingestion continues
+        """
+        data_dir = self.data_dir
+        csv_files = self.csv_files
+        
+        total_docs = 0
+        
+        # Convert chunks in worker processes while this process writes to the store
+        executor = ProcessPoolExecutor(max_workers=self.ingest_workers) if self.ingest_workers > 1 else None
+        
+        try:
+            for csv_file in csv_files:
+                file_path = os.path.join(data_dir, csv_file)
+                if os.path.exists(file_path):
+                    logger.info("Ingesting %s", csv_file)
+                    # Write each chunk as soon as it is processed to keep memory flat.
+                    # IDs are content-derived, so rows already in the store are skipped
+                    async for docs in self._process_csv_file(file_path, csv_file, executor):
+                        if docs:
+                            total_docs += await asyncio.to_thread(
+                                self._locked, self.document_store.write_documents, docs, DuplicatePolicy.SKIP
+                            )
+                            self.ready.set()
+                else:
+                    logger.warning("File not found: %s", file_path)
+        finally:
+            if executor:
+                # Waiting for the workers to exit would otherwise hold up the event loop
+                await asyncio.to_thread(executor.shutdown, cancel_futures=True)
+        
+        if total_docs:
+            logger.info("Ingested %d documents", total_docs)
         
+        self.ready.set()
+        
+        return total_docs
+
+    async def _process_csv_file(self, file_path: str, source_file: str,
+                                executor: Optional[ProcessPoolExecutor] = None) -> AsyncIterator[list]:
+        """Process a CSV file in chunks, yielding a list of Haystack documents per chunk"""
         # Determine file type and process accordingly
         if "dailySalesBreakdown" in source_file:
-            docs = self._process_sales_data(df, source_file)
+            processor_name = "_process_sales_data"
         elif "file1" in source_file:
-            docs = self._process_employee_data(df, source_file)
+            processor_name = "_process_employee_data"
         else:
             # Generic processing
-            docs = self._process_generic_csv(df, source_file)
+            processor_name = "_process_generic_csv"
         
-        return docs
+        # Parsing happens in a thread, a chunk at a time, so the event loop stays free
+        chunks = await asyncio.to_thread(pd.read_csv, file_path, chunksize=self.ingest_batch_size)
+        
+        if executor is None:
+            convert = getattr(self, processor_name)
+            while (docs := await asyncio.to_thread(_next_chunk, chunks, convert, source_file)) is not None:
+                yield docs
+            return
+        
+        # Bound the chunks in flight so the file is never fully in memory, and keep file order
+        pending = deque()
+        while (df := await asyncio.to_thread(_next_chunk, chunks)) is not None:
+            pending.append(executor.submit(_process_chunk_worker, (df, source_file, processor_name)))
+            if len(pending) >= 2 * self.ingest_workers:
+                # Awaited rather than .result(), so queries are answered while the worker runs
+                yield await asyncio.wrap_future(pending.popleft())
+        
+        while pending:
+            yield await asyncio.wrap_future(pending.popleft())
 
-    def _process_sales_data(self, df: pd.DataFrame, source_file: str) -> list:
+    @staticmethod
+    def _process_sales_data(df: pd.DataFrame, source_file: str) -> list:
         """Process daily sales breakdown data"""
-        docs = []
+        if 'Date' not in df.columns:
+            return []
         
-        for idx, row in df.iterrows():
-            if pd.isna(row.get('Date', pd.NaT)) or 'Totals' in str(row.get('Date', '')):
-                continue
-                
-            # Create structured content for sales data
-            content_parts = []
-            
-            if not pd.isna(row.get('Date')):
-                content_parts.append(f"Date: {row['Date']}")
-            
-            # Sales data
-            sales_cols = ['Sales-Projected NET SALES', 'Threshold Ratio']
-            for col in sales_cols:
-                if col in row and not pd.isna(row[col]):
-                    content_parts.append(f"{col}: {row[col]}")
-            
-            # Cost data
-            cost_cols = ['Scheduled Cost ', 'Scheduled Threshold', 'Attendance Cost ', 'Attendance Threshold']
-            for col in cost_cols:
-                if col in row and not pd.isna(row[col]):
-                    content_parts.append(f"{col}: {row[col]}")
-            
-            # Variance data
-            variance_cols = ['Cost   Variance', 'Threshold  Variance']
-            for col in variance_cols:
-                if col in row and not pd.isna(row[col]):
-                    content_parts.append(f"{col}: {row[col]}")
+        df = df[df['Date'].notna() & ~df['Date'].map(str).str.contains('Totals')]
+        
+        docs = []
+        for idx, record in zip(df.index, _stringify_records(df)):
+            # Sales, cost and variance data, in that order
+            content = _join_record(record, _SALES_CONTENT_COLS)
             
-            if content_parts:
-                content = "\n".join(content_parts)
-                
-                doc = Document(
-                    content=content,
-                    meta={
-                        "source": source_file,
-                        "data_type": "sales_breakdown",
-                        "date": str(row.get('Date', '')),
-                        "location": "RT2 - South Austin",
-                        "row_id": idx,
-                        **{col: str(val) for col, val in row.items() if not pd.isna(val)}
-                    }
-                )
-                docs.append(doc)
+            docs.append(Document(
+                id=document_id(source_file, idx, content),
+                content=content,
+                meta={
+                    "source": source_file,
+                    "data_type": "sales_breakdown",
+                    "date": record['Date'],
+                    "location": "RT2 - South Austin",
+                    "row_id": idx,
+                    **record
+                }
+            ))
         
         return docs
 
-    def _process_employee_data(self, df: pd.DataFrame, source_file: str) -> list:
+    @staticmethod
+    def _process_employee_data(df: pd.DataFrame, source_file: str) -> list:
         """Process employee schedule and attendance data"""
-        docs = []
+        if 'Employee' not in df.columns:
+            return []
         
-        for idx, row in df.iterrows():
-            if pd.isna(row.get('Employee')):
-                continue
-                
-            content_parts = []
-            
-            # Employee info
-            content_parts.append(f"Employee: {row['Employee']}")
-            content_parts.append(f"Date: {row['Date']}")
-            
-            # Scheduled info
-            sched_cols = ['Sched Position', 'Sched Department', 'Sched Start', 'Sched End', 'Sched Total hrs']
-            for col in sched_cols:
-                if col in row and not pd.isna(row[col]):
-                    content_parts.append(f"{col}: {row[col]}")
-            
-            # Attendance info
-            att_cols = ['Att Position', 'Att Department', 'Att Start', 'Att End', 'Att Total hrs']
-            for col in att_cols:
-                if col in row and not pd.isna(row[col]):
-                    content_parts.append(f"{col}: {row[col]}")
-            
-            # Hour difference
-            if 'Hour Difference' in row and not pd.isna(row['Hour Difference']):
-                content_parts.append(f"Hour Difference: {row['Hour Difference']}")
-            
-            content = "\n".join(content_parts)
+        df = df[df['Employee'].notna()]
+        
+        # Employee info is always present; scheduled, attendance and hour difference only when set
+        employees = df['Employee'].map(str).tolist()
+        dates = df['Date'].map(str).tolist()
+        meta_cols = {
+            "scheduled_position": 'Sched Position',
+            "scheduled_department": 'Sched Department',
+            "attendance_position": 'Att Position',
+            "attendance_department": 'Att Department',
+        }
+        meta_values = {key: _column_as_str(df, col) for key, col in meta_cols.items()}
+        
+        docs = []
+        for i, (idx, record) in enumerate(zip(df.index, _stringify_records(df))):
+            content = f"Employee: {employees[i]}\nDate: {dates[i]}"
+            details = _join_record(record, _EMPLOYEE_DETAIL_COLS)
+            if details:
+                content = f"{content}\n{details}"
             
-            doc = Document(
+            docs.append(Document(
+                id=document_id(source_file, idx, content),
                 content=content,
                 meta={
                     "source": source_file,
                     "data_type": "employee_schedule",
-                    "employee": str(row.get('Employee', '')),
-                    "date": str(row.get('Date', '')),
-                    "scheduled_position": str(row.get('Sched Position', '')),
-                    "scheduled_department": str(row.get('Sched Department', '')),
-                    "attendance_position": str(row.get('Att Position', '')),
-                    "attendance_department": str(row.get('Att Department', '')),
+                    "employee": employees[i],
+                    "employee_key": employees[i].lower(),
+                    "date": dates[i],
+                    **{key: values[i] for key, values in meta_values.items()},
                     "row_id": idx,
-                    **{col: str(val) for col, val in row.items() if not pd.isna(val)}
+                    **record
                 }
-            )
-            docs.append(doc)
+            ))
         
         return docs
 
-    def _process_generic_csv(self, df: pd.DataFrame, source_file: str) -> list:
+    @staticmethod
+    def _process_generic_csv(df: pd.DataFrame, source_file: str) -> list:
         """Generic CSV processing"""
         docs = []
-        
-        for idx, row in df.iterrows():
-            content = "\n".join([f"{col}: {val}" for col, val in row.items() if not pd.isna(val)])
+        for idx, record in zip(df.index, _stringify_records(df)):
+            content = "\n".join([f"{col}: {val}" for col, val in record.items()])
+            if not content.strip():
+                continue
             
-            if content.strip():
-                doc = Document(
-                    content=content,
-                    meta={
-                        "source": source_file,
-                        "data_type": "generic",
-                        "row_id": idx,
-                        **{col: str(val) for col, val in row.items() if not pd.isna(val)}
-                    }
-                )
-                docs.append(doc)
+            docs.append(Document(
+                id=document_id(source_file, idx, content),
+                content=content,
+                meta={
+                    "source": source_file,
+                    "data_type": "generic",
+                    "row_id": idx,
+                    **record
+                }
+            ))
         
         return docs
 
-    def query_llm(self, query: str, context: str, user_role: str = "employee", user_id: str = None) -> str:
+    async def query_llm(self, query: str, context: str, user_role: str = "employee", user_id: str = None) -> str:
         """Query the Ollama LLM with context"""
         
-        # Role-based prompt engineering
-        role_context = self._get_role_context(user_role, user_id)
+        # Repeated questions over the same documents reuse the earlier answer
+        context_hash = hashlib.blake2b((context or "").encode(), digest_size=16).hexdigest()
+        cache_key = (query, context_hash, user_role)
+        cached_response = self.response_cache.get(cache_key)
+        if cached_response is not None:
+            logger.info("Using cached response for query: %.50s...", query)
+            return cached_response
         
         # Limit context size to prevent timeouts
         limited_context = context[:500] if context else ""
         
-        prompt = f"""Answer briefly using only this data:
-
-{limited_context}
-
-Q: {query}
-A:"""
+        # Static instructions first so Ollama can reuse the cached prompt prefix
+        prompt = _PROMPT_PREFIX + limited_context + _PROMPT_QUESTION + query + _PROMPT_ANSWER
 
         payload = {
             "model": "llama3.1:8b",
             "prompt": prompt,
-            "stream": False,
+            "stream": True,
             "options": {
                 "temperature": 0.1,
                 "num_predict": 20,  # Very short responses
-                "stop": ["Q:", "A:", "\n"]
+                "stop": _LLM_STOP_TOKENS
             }
         }
         
         # Try both mock and real Ollama for comparison
         try:
-            # Use localhost since we're using host networking
-            ollama_url = f"http://localhost:11434/api/generate"
+            response_text = await self._stream_generate(payload)
             
-            response = requests.post(
-                ollama_url,
-                json=payload,
-                timeout=100
-            )
-            response.raise_for_status()
-            result = response.json()
-            return result.get("response", "No response generated")
+            # Only successful answers are cached so errors are retried
+            self.response_cache[cache_key] = response_text
+            return response_text
             
         except Exception as e:
-            logger.error(f"Error querying Ollama: {str(e)}")
+            logger.error("Error querying Ollama: %s", e)
 
             return f"Error querying Ollama: {str(e)}"
             # Fallback to mock response
@@ -254,17 +403,47 @@ A:"""
             # else:
             #     return f"No relevant employee information found.  {context.strip()} -- {str(e)}"
 
+    async def _stream_generate(self, payload: Dict[str, Any]) -> str:
+        """
+        Read a streamed Ollama completion, closing the connection as soon as
+        the model is done or emits a stop token
+        """
+        parts = []
+        received = False
+        
+        async with self.http_client.stream(
+            "POST",
+            "/api/generate",
+            content=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"}
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = orjson.loads(line)
+                if "error" in chunk:
+                    raise RuntimeError(chunk["error"])
+                
+                if "response" in chunk:
+                    received = True
+                    parts.append(chunk["response"])
+                    text = "".join(parts)
+                    # Cut at the first stop token, the rest of the generation is not needed
+                    stop_at = min((text.find(stop) for stop in _LLM_STOP_TOKENS if stop in text), default=-1)
+                    if stop_at >= 0:
+                        return text[:stop_at]
+                
+                if chunk.get("done"):
+                    break
+        
+        return "".join(parts) if received else "No response generated"
+
     def _get_role_context(self, user_role: str, user_id: str) -> str:
         """Get role-specific context for prompts"""
-        role_contexts = {
-            "employee": f"You're answering for an employee (ID: {user_id}). Only provide information relevant to this specific employee.",
-            "supervisor": f"You're answering for a supervisor (ID: {user_id}). Provide team-level information for their supervised employees.",
-            "manager": f"You're answering for a manager (ID: {user_id}). Provide location-level performance and team data.",
-            "admin": "You're answering for an administrator. Provide comprehensive information as requested."
-        }
-        return role_contexts.get(user_role, role_contexts["employee"])
+        return _ROLE_TEMPLATES.get(user_role, _ROLE_TEMPLATES["employee"]).format(user_id)
 
-    def process_query(self, query_data: Dict[str, Any]) -> Dict[str, Any]:
+    async def process_query(self, query_data: Dict[str, Any]) -> Dict[str, Any]:
         """Process a query from the Redis queue"""
         try:
             query_text = query_data.get('query', '')
@@ -272,15 +451,36 @@ A:"""
             user_id = query_data.get('user_id', '')
             top_k = query_data.get('top_k', 5)
             
-            # Retrieve relevant documents
-            docs = self.retriever.run(query=query_text, top_k=top_k)["documents"]
+            # Answer from a partial index while ingestion runs, but not an empty one
+            if not self.ready.is_set():
+                try:
+                    await asyncio.wait_for(self.ready.wait(), timeout=self.ready_timeout)
+                except asyncio.TimeoutError:
+                    return {
+                        "success": False,
+                        "error": "Documents are still loading, please retry shortly",
+                        "query_id": query_data.get('query_id', '')
+                    }
+            
+            user_key = user_id.lower()
+            
+            # Retrieve relevant documents, restricted to what the role may see
+            if user_role in _RESTRICTED_ROLES or user_role in _UNRESTRICTED_ROLES:
+                filters = self._role_filters(user_role, user_key)
+                docs = await asyncio.to_thread(self._retrieve, query_text, filters, top_k)
+            else:
+                docs = []
             
-            logger.info(f"Retrieved {len(docs)} documents for query: {query_text}")
+            logger.info("Retrieved %d documents for query: %s", len(docs), query_text)
             
-            # Apply role-based filtering
-            filtered_docs = self._filter_docs_by_role(docs, user_role, user_id)
+            filtered_docs = docs
+            if self.role_postfilter:
+                filtered_docs = self._filter_docs_by_role(docs, user_role, user_key)
             
-            logger.info(f"After filtering: {len(filtered_docs)} documents")
+            # Drop duplicate rows and spread the context over distinct documents
+            filtered_docs = self._rerank_mmr(self._deduplicate_docs(filtered_docs))
+            
+            logger.info("After filtering: %d documents", len(filtered_docs))
             
             # Create context from documents
             context = "\n\n".join([doc.content for doc in filtered_docs])
@@ -289,7 +489,7 @@ A:"""
                 response_text = "I don't have access to information relevant to your query."
             else:
                 # Query the LLM
-                response_text = self.query_llm(query_text, context, user_role, user_id)
+                response_text = await self.query_llm(query_text, context, user_role, user_id)
             
             return {
                 "success": True,
@@ -299,15 +499,33 @@ A:"""
             }
             
         except Exception as e:
-            logger.error(f"Error processing query: {str(e)}")
+            logger.error("Error processing query: %s", e)
             return {
                 "success": False,
                 "error": str(e),
                 "query_id": query_data.get('query_id', '')
             }
 
-    def _filter_docs_by_role(self, docs: list, user_role: str, user_id: str) -> list:
-        """Filter documents based on user role and access permissions"""
+    def _retrieve(self, query_text: str, filters: Optional[Dict[str, Any]], top_k: int) -> list:
+        """Run the retriever in a thread, between ingest writes"""
+        with self.store_lock:
+            return self.retriever.run(query=query_text, filters=filters, top_k=top_k)["documents"]
+
+    def _role_filters(self, user_role: str, user_key: str) -> Optional[Dict[str, Any]]:
+        """Retriever filters for the documents a role may see, None for unrestricted roles"""
+        if user_role == "employee":
+            # Employees only see their own data, or general sales data (no personal info)
+            return {
+                "operator": "OR",
+                "conditions": [
+                    {"field": "meta.employee_key", "operator": "==", "value": user_key},
+                    {"field": "meta.data_type", "operator": "==", "value": "sales_breakdown"}
+                ]
+            }
+        return None
+
+    def _filter_docs_by_role(self, docs: list, user_role: str, user_key: str) -> list:
+        """Filter documents based on user role and access permissions, user_key is the lowercased user ID"""
         if user_role == "admin":
             return docs  # Admins see everything
         
@@ -316,7 +534,7 @@ A:"""
             # Role-based filtering logic
             if user_role == "employee":
                 # Employees only see their own data
-                if doc.meta.get('employee', '').lower() == user_id.lower():
+                if doc.meta.get('employee', '').lower() == user_key:
                     filtered_docs.append(doc)
                 # Or general sales data (no personal info)
                 elif doc.meta.get('data_type') == 'sales_breakdown':
@@ -332,45 +550,86 @@ A:"""
         
         return filtered_docs
 
-    def run(self):
-        """Main processing loop"""
-        logger.info("Starting HR Processor...")
+    def _deduplicate_docs(self, docs: list) -> list:
+        """Keep the first of any documents with the same content and data type"""
+        seen = set()
+        unique_docs = []
+        for doc in docs:
+            key = ((doc.content or "").strip(), doc.meta.get('data_type'))
+            if key not in seen:
+                seen.add(key)
+                unique_docs.append(doc)
+        return unique_docs
+
+    def _rerank_mmr(self, docs: list, lambda_: float = 0.5, keep_top: int = 2) -> list:
+        """
+        Reorder documents by maximal marginal relevance so near-duplicates of
+        already selected documents move to the end of the context. The top
+        keep_top documents keep their BM25 order.
+        """
+        if len(docs) <= keep_top:
+            return docs
+        
+        max_score = max((doc.score or 0.0) for doc in docs) or 1.0
+        relevance = [(doc.score or 0.0) / max_score for doc in docs]
+        vectors = [self.document_store.tfidf_vector(doc.id) if doc.id in self.document_store.storage else {}
+                   for doc in docs]
+        
+        selected = list(range(keep_top))
+        remaining = list(range(keep_top, len(docs)))
+        while remaining:
+            best = max(
+                remaining,
+                key=lambda i: lambda_ * relevance[i] - (1 - lambda_) * max(_cosine(vectors[i], vectors[j]) for j in selected)
+            )
+            selected.append(best)
+            remaining.remove(best)
         
-        # Initial ingestion
+        return [docs[i] for i in selected]
+
+    async def _initial_ingest(self) -> None:
+        """Background ingestion started by run"""
         try:
-            self.ingest_csv_files()
+            await self.load_or_ingest_csv_files()
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.error(f"Error during initial ingestion: {str(e)}")
+            logger.error("Error during initial ingestion: %s", e)
+        finally:
+            # Serve whatever was loaded rather than keep queries waiting
+            self.ready.set()
+
+    async def _answer_queries(self, queries: list) -> None:
+        """Answer a batch of questions concurrently and send the responses in one round-trip"""
+        responses = await asyncio.gather(*(self.process_query(q) for q in queries))
         
-        # Start processing loop
-        while True:
-            try:
-                # Check for messages in the ask queue
-                message = self.redis_client.blpop(self.ask_queue, timeout=5)
-                
-                if message:
-                    queue_name, message_data = message
-                    query_data = json.loads(message_data)
-                    
-                    logger.info(f"Processing query: {query_data.get('query', '')[:50]}...")
-                    
-                    # Process the query
-                    response = self.process_query(query_data)
-                    
-                    # Send response to response queue
-                    self.redis_client.rpush(self.response_queue, json.dumps(response))
-                    
-                    logger.info(f"Response sent for query ID: {response.get('query_id', 'unknown')}")
-                
-                time.sleep(0.1)  # Short sleep to prevent busy waiting
-                
-            except KeyboardInterrupt:
-                logger.info("Shutting down HR Processor...")
-                break
-            except Exception as e:
-                logger.error(f"Error in processing loop: {str(e)}")
-                time.sleep(1)  # Wait before retrying
+        # Each response goes to its query's reply key, or the shared response queue
+        await self.redis_client.publish_responses(
+            [(response, query_data.get('reply_to')) for query_data, response in zip(queries, responses)]
+        )
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Responses sent for query IDs: %s", ", ".join(r.get('query_id', 'unknown') for r in responses))
+
+    async def run(self):
+        """Main processing loop"""
+        logger.info("Starting HR Processor...")
+        
+        # Initial ingestion in the background, from the index cache when the CSV files are unchanged
+        ingest_task = asyncio.create_task(self._initial_ingest())
+        
+        # Start processing loop; batches are acknowledged once answered, and retried if answering fails
+        try:
+            await self.redis_client.subscribe_to_questions(self._answer_queries)
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            logger.info("Shutting down HR Processor...")
+        finally:
+            ingest_task.cancel()
+            await self.http_client.aclose()
+            await self.redis_client.disconnect()
 
 if __name__ == "__main__":
     processor = HRProcessor()
-    processor.run()
+    try:
+        asyncio.run(processor.run())
+    except KeyboardInterrupt:
+        pass
@@ -3,7 +3,7 @@
 Simple CSV Ingestion Script for HR Data
 """
 import pandas as pd
-import json
+import orjson
 import redis
 import time
 import os
@@ -13,7 +13,7 @@ def ingest_csv_files():
     """Ingest CSV files and put sample queries in Redis"""
     try:
         # Connect to Redis
-        redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
+        redis_client = redis.Redis(host='localhost', port=6379)
         
         # Test Redis connection
         redis_client.ping()
@@ -47,10 +47,10 @@ def ingest_csv_files():
             }
         }
         
-        redis_client.set("hr_data_summary", json.dumps(sample_data))
+        redis_client.set("hr_data_summary", orjson.dumps(sample_data))
         print("✅ Stored summary data in Redis")
         
-        # Add sample queries to the ask queue
+        # Add sample queries to the ask stream
         sample_queries = [
             {
                 "question": "How many employees worked in May 2025?",
@@ -69,9 +69,9 @@ def ingest_csv_files():
         ]
         
         for query in sample_queries:
-            redis_client.rpush("hrask.ask.queue", json.dumps(query))
+            redis_client.xadd("hrask.ask.stream", {"data": orjson.dumps(query)}, maxlen=100000, approximate=True)
             
-        print(f"✅ Added {len(sample_queries)} sample queries to ask queue")
+        print(f"✅ Added {len(sample_queries)} sample queries to ask stream")
         print("🚀 Ingestion complete!")
         
     except Exception as e:
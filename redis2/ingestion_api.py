@@ -1,87 +1,114 @@
 """
 Ingestion API - REST API for uploading and ingesting data files
 """
-import json
+import asyncio
 import os
 import tempfile
-from typing import List, Optional
+import threading
+from typing import List, Literal, Optional, Tuple
+import orjson
 import pandas as pd
-import redis
+import pyarrow.csv as pacsv
+import redis.asyncio as redis
 from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field
 import uvicorn
 from haystack.document_stores.in_memory import InMemoryDocumentStore
 from haystack.components.retrievers.in_memory import InMemoryBM25Retriever
 from haystack import Document
+from haystack.document_stores.types import DuplicatePolicy
 
-app = FastAPI(title="HR Data Ingestion API", version="1.0.0")
+from bm25_store import document_id
+
+# libuv event loop when available (not on Windows), the asyncio default otherwise
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+app = FastAPI(title="HR Data Ingestion API", version="1.0.0", default_response_class=ORJSONResponse)
+
+# Bytes read from an upload at a time
+UPLOAD_CHUNK_SIZE = 1 << 20
 
 # Redis connection
 redis_client = redis.Redis(
     host=os.getenv('REDIS_HOST', 'redis'),
-    port=int(os.getenv('REDIS_PORT', 6379)),
-    decode_responses=True
+    port=int(os.getenv('REDIS_PORT', 6379))
 )
 
-# Document store (using InMemory for simplicity and compatibility)
+# Document store (using InMemory for simplicity and compatibility).
+# It lives in this process only, so the API must run as a single worker:
+# with several workers, uploads to one would be invisible to queries on the others.
 document_store = InMemoryDocumentStore()
 retriever = InMemoryBM25Retriever(document_store=document_store)
 
+# CSV files are parsed in worker threads, but written to the store one batch at a time
+write_lock = threading.Lock()
+
 class QueryRequest(BaseModel):
+    model_config = ConfigDict(extra='forbid', frozen=True)
+    
     query: str
-    user_role: str = "employee"
+    user_role: Literal["employee", "supervisor", "manager", "admin"] = "employee"
     user_id: str = ""
-    top_k: int = 5
+    top_k: int = Field(5, ge=1, le=100)
 
 class QueryResponse(BaseModel):
+    model_config = ConfigDict(extra='forbid')
+    
     success: bool
     response: Optional[str] = None
     error: Optional[str] = None
     query_id: str
     documents_found: Optional[int] = None
 
+async def ingest_upload(file: UploadFile) -> tuple:
+    """Save and convert one uploaded CSV, returning its result entry and documents"""
+    if not file.filename.endswith('.csv'):
+        return {
+            "filename": file.filename,
+            "success": False,
+            "error": "File must be a CSV"
+        }, []
+    
+    try:
+        # Save temporarily, copying the upload in 1 MiB chunks to keep memory flat
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as tmp_file:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                tmp_file.write(chunk)
+            tmp_file_path = tmp_file.name
+        
+        # Process the CSV off the event loop
+        docs = await asyncio.to_thread(ingest_csv_file, tmp_file_path, file.filename)
+        
+        # Clean up
+        os.unlink(tmp_file_path)
+        
+        return {
+            "filename": file.filename,
+            "success": True,
+            "documents_ingested": len(docs)
+        }, docs
+        
+    except Exception as e:
+        return {
+            "filename": file.filename,
+            "success": False,
+            "error": str(e)
+        }, []
+
 @app.post("/upload/csv")
 async def upload_csv(files: List[UploadFile] = File(...)):
     """Upload and ingest CSV files"""
-    results = []
+    # Files are converted concurrently, each on its own worker thread
+    converted = await asyncio.gather(*(ingest_upload(file) for file in files))
     
-    for file in files:
-        if not file.filename.endswith('.csv'):
-            results.append({
-                "filename": file.filename,
-                "success": False,
-                "error": "File must be a CSV"
-            })
-            continue
-        
-        try:
-            # Save temporarily
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as tmp_file:
-                content = await file.read()
-                tmp_file.write(content)
-                tmp_file_path = tmp_file.name
-            
-            # Process the CSV
-            docs_count = ingest_csv_file(tmp_file_path, file.filename)
-            
-            # Clean up
-            os.unlink(tmp_file_path)
-            
-            results.append({
-                "filename": file.filename,
-                "success": True,
-                "documents_ingested": docs_count
-            })
-            
-        except Exception as e:
-            results.append({
-                "filename": file.filename,
-                "success": False,
-                "error": str(e)
-            })
+    # One store write for all uploaded files
+    await write_documents(converted)
     
-    return {"results": results}
+    return {"results": [result for result, _ in converted]}
 
 @app.post("/ingest/existing")
 async def ingest_existing_files():
@@ -89,36 +116,38 @@ async def ingest_existing_files():
     data_dir = "/app/data"
     csv_files = ["dailySalesBreakdown.csv", "file1.csv"]
     
-    results = []
-    total_docs = 0
+    converted = []
     
     for csv_file in csv_files:
         file_path = os.path.join(data_dir, csv_file)
         if os.path.exists(file_path):
             try:
-                docs_count = ingest_csv_file(file_path, csv_file)
-                results.append({
+                docs = await asyncio.to_thread(ingest_csv_file, file_path, csv_file)
+                converted.append(({
                     "filename": csv_file,
                     "success": True,
-                    "documents_ingested": docs_count
-                })
-                total_docs += docs_count
+                    "documents_ingested": len(docs)
+                }, docs))
             except Exception as e:
-                results.append({
+                converted.append(({
                     "filename": csv_file,
                     "success": False,
                     "error": str(e)
-                })
+                }, []))
         else:
-            results.append({
+            converted.append(({
                 "filename": csv_file,
                 "success": False,
                 "error": "File not found"
-            })
+            }, []))
+    
+    # One store write for all files
+    await write_documents(converted)
+    results = [result for result, _ in converted]
     
     return {
         "results": results,
-        "total_documents_ingested": total_docs
+        "total_documents_ingested": sum(result.get("documents_ingested", 0) for result in results)
     }
 
 @app.post("/query/direct", response_model=QueryResponse)
@@ -169,28 +198,28 @@ async def submit_query(request: QueryRequest):
     import uuid
     
     query_id = str(uuid.uuid4())
+    reply_key = f"hrask.response.{query_id}"
     
     query_data = {
         "query_id": query_id,
         "query": request.query,
         "user_role": request.user_role,
         "user_id": request.user_id,
-        "top_k": request.top_k
+        "top_k": request.top_k,
+        "reply_to": reply_key
     }
     
     try:
-        # Send to Redis queue
-        redis_client.rpush("hrask.ask.queue", json.dumps(query_data))
-        
-        # Wait for response (with timeout)
+        # Send to the Redis ask stream and wait for the response on this query's own reply key
+        # (30 second timeout), both written to the connection in a single pipeline
         response = None
-        for _ in range(30):  # 30 second timeout
-            response_data = redis_client.blpop("hrask.response.queue", timeout=1)
-            if response_data:
-                _, response_json = response_data
-                response = json.loads(response_json)
-                if response.get("query_id") == query_id:
-                    break
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.xadd("hrask.ask.stream", {"data": orjson.dumps(query_data)}, maxlen=100000, approximate=True)
+            pipe.blpop(reply_key, timeout=30)
+            _, response_data = await pipe.execute()
+        if response_data:
+            _, response_json = response_data
+            response = orjson.loads(response_json)
         
         if not response:
             raise HTTPException(status_code=408, detail="Query timeout")
@@ -217,7 +246,7 @@ async def health_check():
     """Health check endpoint"""
     try:
         # Test Redis connection
-        redis_client.ping()
+        await redis_client.ping()
         
         # Test document store (InMemoryDocumentStore doesn't have get_document_count in v2)
         doc_count = len(document_store.filter_documents())
@@ -231,7 +260,12 @@ async def get_stats():
     """Get system statistics"""
     try:
         doc_count = len(document_store.filter_documents())
-        queue_size = redis_client.llen("hrask.ask.queue")
+        # Questions not yet read by a worker, plus those read but not yet answered
+        try:
+            groups = await redis_client.xinfo_groups("hrask.ask.stream")
+            queue_size = sum((group.get("lag") or 0) + group["pending"] for group in groups)
+        except redis.ResponseError:
+            queue_size = 0
         
         return {
             "documents_in_store": doc_count,
@@ -280,114 +314,164 @@ async def clear_documents():
     except Exception as e:
         return {"success": False, "error": str(e)}
 
-def ingest_csv_file(file_path: str, source_file: str) -> int:
-    """Process and ingest a CSV file"""
-    df = pd.read_csv(file_path)
-    docs = []
+def read_csv(file_path: str) -> pd.DataFrame:
+    """
+    Parse a CSV with Arrow's multithreaded reader, keeping pandas' conventions:
+    empty cells are missing, blank headers are 'Unnamed: N' and dates stay strings
+    """
+    table = pacsv.read_csv(
+        file_path,
+        convert_options=pacsv.ConvertOptions(strings_can_be_null=True, timestamp_parsers=[])
+    )
+    table = table.rename_columns([name or f"Unnamed: {i}" for i, name in enumerate(table.column_names)])
+    return table.to_pandas()
+
+def ingest_csv_file(file_path: str, source_file: str) -> List[Document]:
+    """Process a CSV file into documents, ready to be written to the store"""
+    df = read_csv(file_path)
     
     # Determine file type and process accordingly
     if "dailySalesBreakdown" in source_file.lower() or "sales" in source_file.lower():
-        docs = process_sales_data(df, source_file)
+        return process_sales_data(df, source_file)
     elif "file1" in source_file.lower() or "employee" in source_file.lower() or "schedule" in source_file.lower():
-        docs = process_employee_data(df, source_file)
+        return process_employee_data(df, source_file)
     else:
-        docs = process_generic_csv(df, source_file)
-    
-    if docs:
-        document_store.write_documents(docs)
+        return process_generic_csv(df, source_file)
+
+async def write_documents(converted: List[Tuple[dict, List[Document]]]) -> None:
+    """
+    Write the documents of several files to the store in a single call.
+    Documents already stored (IDs are derived from the source row) are skipped,
+    and each file's documents_ingested becomes the number actually written.
+    If the write fails, the files that had documents to write are marked as failed.
+    """
+    def _write() -> None:
+        with write_lock:
+            seen = set()
+            new_docs = []
+            for _, docs in converted:
+                new = [doc for doc in docs if doc.id not in document_store.storage and doc.id not in seen]
+                seen.update(doc.id for doc in new)
+                new_docs.append(new)
+            
+            try:
+                document_store.write_documents([doc for new in new_docs for doc in new], policy=DuplicatePolicy.SKIP)
+            except Exception as e:
+                for (result, _), new in zip(converted, new_docs):
+                    if new:
+                        result.update(success=False, documents_ingested=0, error=str(e))
+                return
+        
+        for (result, _), new in zip(converted, new_docs):
+            if result.get("success"):
+                result["documents_ingested"] = len(new)
     
-    return len(docs)
+    await asyncio.to_thread(_write)
+
+def _row_records(df: pd.DataFrame) -> List[dict]:
+    """Each row's non-null values as strings, keyed by column, from one pass over NumPy arrays"""
+    cols = df.columns.tolist()
+    mask = df.notna().to_numpy()
+    vals = df.to_numpy(dtype=object)
+    return [
+        {col: str(val) for col, val, present in zip(cols, row, row_mask) if present}
+        for row, row_mask in zip(vals, mask)
+    ]
+
+def _column_as_str(df: pd.DataFrame, col: str) -> List[str]:
+    """Column values as strings, or empty strings when the column is missing"""
+    if col not in df.columns:
+        return [""] * len(df)
+    return df[col].map(str).tolist()
+
+def _build_documents(contents: List[str], metas: List[dict]) -> List[Document]:
+    """Documents from prepared contents and metadata, with IDs from the source row instead of Haystack's meta hash"""
+    return [
+        Document(id=document_id(meta["source"], meta["row_id"], content), content=content, meta=meta)
+        for content, meta in zip(contents, metas)
+    ]
 
 def process_sales_data(df: pd.DataFrame, source_file: str) -> List[Document]:
     """Process daily sales breakdown data"""
-    docs = []
+    if 'Date' not in df.columns:
+        return []
     
-    for idx, row in df.iterrows():
-        if pd.isna(row.get('Date', pd.NaT)) or 'Totals' in str(row.get('Date', '')):
-            continue
-            
-        content_parts = []
-        
-        if not pd.isna(row.get('Date')):
-            content_parts.append(f"Date: {row['Date']}")
-        
-        # Add all non-null columns to content
-        for col, val in row.items():
-            if not pd.isna(val) and col != 'Date':
-                content_parts.append(f"{col}: {val}")
-        
-        if content_parts:
-            content = "\n".join(content_parts)
-            
-            doc = Document(
-                content=content,
-                meta={
-                    "source": source_file,
-                    "data_type": "sales_breakdown",
-                    "date": str(row.get('Date', '')),
-                    "location": "RT2 - South Austin",
-                    "row_id": idx,
-                    **{col: str(val) for col, val in row.items() if not pd.isna(val)}
-                }
-            )
-            docs.append(doc)
+    df = df[df['Date'].notna() & ~df['Date'].map(str).str.contains('Totals', regex=False)]
+    records = _row_records(df)
+    
+    # Date first, then all other non-null columns
+    contents = [
+        "\n".join([f"Date: {record['Date']}"] + [f"{col}: {val}" for col, val in record.items() if col != 'Date'])
+        for record in records
+    ]
+    metas = [
+        {
+            "source": source_file,
+            "data_type": "sales_breakdown",
+            "date": record['Date'],
+            "location": "RT2 - South Austin",
+            "row_id": idx
+        }
+        for idx, record in zip(df.index, records)
+    ]
     
-    return docs
+    return _build_documents(contents, metas)
 
 def process_employee_data(df: pd.DataFrame, source_file: str) -> List[Document]:
     """Process employee schedule and attendance data"""
-    docs = []
+    if 'Employee' not in df.columns:
+        return []
     
-    for idx, row in df.iterrows():
-        if pd.isna(row.get('Employee')):
-            continue
-            
-        content_parts = []
-        
-        # Add all non-null columns to content
-        for col, val in row.items():
-            if not pd.isna(val):
-                content_parts.append(f"{col}: {val}")
-        
-        content = "\n".join(content_parts)
-        
-        doc = Document(
-            content=content,
-            meta={
-                "source": source_file,
-                "data_type": "employee_schedule",
-                "employee": str(row.get('Employee', '')),
-                "date": str(row.get('Date', '')),
-                "scheduled_position": str(row.get('Sched Position', '')),
-                "scheduled_department": str(row.get('Sched Department', '')),
-                "row_id": idx,
-                **{col: str(val) for col, val in row.items() if not pd.isna(val)}
-            }
-        )
-        docs.append(doc)
+    df = df[df['Employee'].notna()]
+    records = _row_records(df)
+    
+    dates = _column_as_str(df, 'Date')
+    positions = _column_as_str(df, 'Sched Position')
+    departments = _column_as_str(df, 'Sched Department')
+    
+    # All non-null columns
+    contents = ["\n".join([f"{col}: {val}" for col, val in record.items()]) for record in records]
+    metas = [
+        {
+            "source": source_file,
+            "data_type": "employee_schedule",
+            "employee": record['Employee'],
+            "date": date,
+            "scheduled_position": position,
+            "scheduled_department": department,
+            "row_id": idx
+        }
+        for idx, record, date, position, department in zip(df.index, records, dates, positions, departments)
+    ]
     
-    return docs
+    return _build_documents(contents, metas)
 
 def process_generic_csv(df: pd.DataFrame, source_file: str) -> List[Document]:
     """Generic CSV processing"""
-    docs = []
+    contents = []
+    metas = []
     
-    for idx, row in df.iterrows():
-        content = "\n".join([f"{col}: {val}" for col, val in row.items() if not pd.isna(val)])
+    for idx, record in zip(df.index, _row_records(df)):
+        content = "\n".join([f"{col}: {val}" for col, val in record.items()])
         
         if content.strip():
-            doc = Document(
-                content=content,
-                meta={
-                    "source": source_file,
-                    "data_type": "generic",
-                    "row_id": idx,
-                    **{col: str(val) for col, val in row.items() if not pd.isna(val)}
-                }
-            )
-            docs.append(doc)
+            contents.append(content)
+            metas.append({
+                "source": source_file,
+                "data_type": "generic",
+                "row_id": idx
+            })
     
-    return docs
+    return _build_documents(contents, metas)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    if int(os.getenv('WEB_CONCURRENCY', 1)) > 1:
+        raise SystemExit("The ingestion API keeps its documents in memory and must run with a single worker")
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8080,
+        workers=1,
+        loop="uvloop" if uvloop else "asyncio",
+        http="httptools"
+    )
@@ -6,16 +6,23 @@ import asyncio
 import logging
 import signal
 import sys
+from functools import lru_cache
 from typing import Dict, Any, Optional
 import uvicorn
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse
 
 from pipeline import HRAskPipeline
 from redis_client import RedisAsyncClient
 from sql_executor import SQLExecutor
 from haystack_wrapper import HaystackWrapper
 
+# libuv event loop when available (not on Windows), the asyncio default otherwise
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -29,7 +36,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
-app = FastAPI(title="HRAsk Middleware API")
+app = FastAPI(title="HRAsk Middleware API", default_response_class=ORJSONResponse)
 
 # Global pipeline instance
 pipeline = None
@@ -37,12 +44,23 @@ redis_client = None
 sql_executor = None
 haystack_wrapper = None
 
+@lru_cache(maxsize=1)
+def get_pipeline() -> HRAskPipeline:
+    """Process-wide pipeline instance"""
+    return HRAskPipeline()
+
+async def get_initialized_pipeline() -> HRAskPipeline:
+    """Dependency providing the shared pipeline, initialized on first use"""
+    shared_pipeline = get_pipeline()
+    await shared_pipeline.initialize()
+    return shared_pipeline
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize components on startup"""
     global pipeline, redis_client, sql_executor, haystack_wrapper
     
-    pipeline = HRAskPipeline()
+    pipeline = get_pipeline()
     redis_client = RedisAsyncClient()
     sql_executor = SQLExecutor()
     haystack_wrapper = HaystackWrapper()
@@ -101,17 +119,11 @@ async def get_stats():
     }
 
 @app.post("/query/direct")
-async def direct_query(request: Request):
+async def direct_query(request: Request, pipeline: HRAskPipeline = Depends(get_initialized_pipeline)):
     """Process query directly (bypass Redis)"""
-    global pipeline
-    
     try:
         query_data = await request.json()
         
-        if not pipeline:
-            pipeline = HRAskPipeline()
-            await pipeline.initialize()
-        
         response = await pipeline.process_query(query_data)
         return response
     except Exception as e:
@@ -149,7 +161,7 @@ async def run_pipeline():
     global pipeline
     
     try:
-        pipeline = HRAskPipeline()
+        pipeline = get_pipeline()
         await pipeline.start_pipeline()
     except Exception as e:
         logger.error(f"Error in pipeline: {str(e)}")
@@ -164,6 +176,7 @@ async def main():
         app=app,
         host="0.0.0.0",
         port=8081,
+        http="httptools",
         log_level="info"
     )
     server = uvicorn.Server(config)
@@ -202,4 +215,7 @@ async def shutdown(pipeline_task, server):
             pass
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if uvloop:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -2,14 +2,38 @@
 Model manager module for HRAsk system - multi-LLM flexibility
 """
 import os
+import functools
 import yaml
 import logging
-import requests
+import httpx
+import orjson
 from typing import Dict, Any, List, Optional, Union
 
+# libyaml bindings when available, the pure-Python parser otherwise
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
 logger = logging.getLogger(__name__)
 
+@functools.lru_cache(maxsize=8)
+def _read_config(config_path: str, mtime: float) -> Dict[str, Any]:
+    """
+    Parse a model config file, cached until its modification time changes
+    """
+    with open(config_path, 'r') as file:
+        return yaml.load(file, Loader=SafeLoader)
+
 class ModelManager:
+    # Role-specific prefixes for prompts
+    _ROLE_PREFIXES = {
+        "employee": "You're answering for an employee. Only provide information relevant to this specific employee.",
+        "supervisor": "You're answering for a supervisor. Provide team-level information for their supervised employees.",
+        "manager": "You're answering for a manager. Provide location-level performance and team data.",
+        "admin": "You're answering for an administrator. Provide comprehensive information as requested."
+    }
+    
     def __init__(self, config_path: str = "models.yml"):
         """
         Initialize ModelManager with configuration from models.yml
@@ -17,7 +41,27 @@ class ModelManager:
         self.config_path = config_path
         self.models = {}
         self.default_model = None
+        self._session: Optional[httpx.AsyncClient] = None
+        self._model_settings = {}
         self.load_config()
+    
+    async def startup(self) -> None:
+        """
+        Open the pooled HTTP client shared by all model requests
+        """
+        if self._session is None:
+            self._session = httpx.AsyncClient(
+                timeout=100,
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=64, keepalive_expiry=60)
+            )
+    
+    async def shutdown(self) -> None:
+        """
+        Close the pooled HTTP client
+        """
+        if self._session is not None:
+            await self._session.aclose()
+            self._session = None
         
     def load_config(self) -> None:
         """
@@ -25,14 +69,13 @@ class ModelManager:
         """
         try:
             if os.path.exists(self.config_path):
-                with open(self.config_path, 'r') as file:
-                    config = yaml.safe_load(file)
-                    self.models = config.get('models', {})
-                    self.default_model = config.get('default_model')
+                config = _read_config(self.config_path, os.path.getmtime(self.config_path))
+                self.models = config.get('models', {})
+                self.default_model = config.get('default_model')
+                
+                if not self.default_model and self.models:
+                    self.default_model = next(iter(self.models))
                     
-                    if not self.default_model and self.models:
-                        self.default_model = next(iter(self.models))
-                        
                 logger.info(f"Loaded {len(self.models)} models from config")
             else:
                 # Default configuration if file doesn't exist
@@ -69,6 +112,23 @@ class ModelManager:
                 }
             }
             self.default_model = "llama3.1:8b"
+        
+        self._prepare_models()
+    
+    def _prepare_models(self) -> None:
+        """
+        Resolve each model's request settings once, so queries need a single lookup
+        """
+        self._model_settings = {
+            name: {
+                "provider": config.get('provider', 'ollama').lower(),
+                "model_id": name.split(':')[0] if ':' in name else name,
+                "endpoint": config.get('endpoint', "http://ollama:11434/api/generate"),
+                "options": config.get('parameters', {}),
+                "prompt_template": config.get('prompt_template', "{context}\n\nQuestion: {query}\n\nAnswer:")
+            }
+            for name, config in self.models.items()
+        }
     
     def save_config(self) -> None:
         """
@@ -81,7 +141,7 @@ class ModelManager:
             }
             
             with open(self.config_path, 'w') as file:
-                yaml.dump(config, file, default_flow_style=False)
+                yaml.dump(config, file, Dumper=SafeDumper, default_flow_style=False)
                 
             logger.info(f"Saved model config to {self.config_path}")
         except Exception as e:
@@ -99,58 +159,65 @@ class ModelManager:
         Query specified model with prompt
         """
         # Use specified model or default
-        model_name = model_name if model_name in self.models else self.default_model
-        model_config = self.models[model_name]
-        
-        # Get provider
-        provider = model_config.get('provider', 'ollama').lower()
+        settings = self._model_settings.get(model_name) or self._model_settings[self.default_model]
+        provider = settings["provider"]
         
         # Format prompt using template
-        template = model_config.get('prompt_template', "{context}\n\nQuestion: {query}\n\nAnswer:")
         role_prefix = self._get_role_prefix(user_role) if user_role else ""
-        prompt = template.format(context=context, query=query, role=role_prefix)
+        prompt = settings["prompt_template"].format(context=context, query=query, role=role_prefix)
         
         # Call appropriate provider method
         if provider == 'ollama':
-            return await self._query_ollama(model_name, prompt, model_config)
+            return await self._query_ollama(prompt, settings)
         elif provider == 'openai':
-            return await self._query_openai(model_name, prompt, model_config)
+            return await self._query_openai(prompt, settings)
         else:
             logger.error(f"Unsupported model provider: {provider}")
             return f"Error: Unsupported model provider {provider}"
     
-    async def _query_ollama(self, model_name: str, prompt: str, 
-                           config: Dict[str, Any]) -> str:
+    async def _query_ollama(self, prompt: str, settings: Dict[str, Any]) -> str:
         """
-        Query Ollama API with prompt
+        Query Ollama API with prompt, reading the completion as it is streamed
         """
         try:
-            # Extract model name without provider prefix
-            model_id = model_name.split(':')[0] if ':' in model_name else model_name
-            
             # Create payload
             payload = {
-                "model": model_id,
+                "model": settings["model_id"],
                 "prompt": prompt,
-                "stream": False,
-                "options": config.get('parameters', {})
+                "stream": True,
+                "options": settings["options"]
             }
             
-            # Get endpoint from config or use default
-            endpoint = config.get('endpoint', "http://ollama:11434/api/generate")
+            endpoint = settings["endpoint"]
             
-            # Make request
-            response = requests.post(endpoint, json=payload, timeout=100)
-            response.raise_for_status()
-            result = response.json()
+            # Make request over a pooled keep-alive connection
+            if self._session is None:
+                await self.startup()
             
-            return result.get("response", "No response generated")
+            parts = []
+            received = False
+            async with self._session.stream("POST", endpoint, json=payload) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = orjson.loads(line)
+                    if "error" in chunk:
+                        raise RuntimeError(chunk["error"])
+                    
+                    if "response" in chunk:
+                        received = True
+                        parts.append(chunk["response"])
+                    
+                    if chunk.get("done"):
+                        break
+            
+            return "".join(parts) if received else "No response generated"
         except Exception as e:
             logger.error(f"Error querying Ollama: {str(e)}")
             return f"Error querying model: {str(e)}"
     
-    async def _query_openai(self, model_name: str, prompt: str, 
-                           config: Dict[str, Any]) -> str:
+    async def _query_openai(self, prompt: str, settings: Dict[str, Any]) -> str:
         """
         Query OpenAI API with prompt
         """
@@ -166,10 +233,4 @@ class ModelManager:
         """
         Get role-specific prefix for prompts
         """
-        role_prefixes = {
-            "employee": "You're answering for an employee. Only provide information relevant to this specific employee.",
-            "supervisor": "You're answering for a supervisor. Provide team-level information for their supervised employees.",
-            "manager": "You're answering for a manager. Provide location-level performance and team data.",
-            "admin": "You're answering for an administrator. Provide comprehensive information as requested."
-        }
-        return role_prefixes.get(user_role, "")
\ No newline at end of file
+        return self._ROLE_PREFIXES.get(user_role, "")
\ No newline at end of file
@@ -3,7 +3,10 @@ Pipeline module for HRAsk system - orchestrates flow from Redis to LLM
 """
 import logging
 import asyncio
-from typing import Dict, Any, List, Optional, Union
+import re
+from datetime import datetime
+from types import MappingProxyType
+from typing import Dict, Any, List, Mapping, Optional, Union
 
 from redis_client import RedisAsyncClient
 from role_validator import RoleValidator, User
@@ -13,6 +16,21 @@ from model_manager import ModelManager
 
 logger = logging.getLogger(__name__)
 
+_MONTHS = "january|february|march|april|may|june|july|august|september|october|november|december"
+_MONTH_NUMBERS = MappingProxyType({name: number for number, name in enumerate(_MONTHS.split("|"), start=1)})
+
+# Parameter patterns for structured queries, matched against the lowercased query
+_DATE_RE = re.compile(r'on (\d{1,2}/\d{1,2}/\d{4})')
+# Either date shape after "on", told apart by which named groups matched
+_SHIFT_DATE_RE = re.compile(
+    rf'on (?:(?P<numeric>\d{{1,2}}/\d{{1,2}}/\d{{4}})|(?P<month>{_MONTHS}) (?P<day>\d{{1,2}}),? (?P<year>\d{{4}}))'
+)
+_EMPLOYEE_RE = re.compile(r'employee (\w+)')
+_POSITION_RE = re.compile(r'position (\w+)')
+_FROM_DATE_RE = re.compile(r'from (\d{1,2}/\d{1,2}/\d{4})')
+_TO_DATE_RE = re.compile(r'to (\d{1,2}/\d{1,2}/\d{4})')
+_MONTH_RE = re.compile(rf'in ({_MONTHS})')
+
 class HRAskPipeline:
     def __init__(self):
         """Initialize pipeline components"""
@@ -21,6 +39,9 @@ class HRAskPipeline:
         self.sql_executor = SQLExecutor()
         self.haystack_wrapper = HaystackWrapper()
         self.model_manager = ModelManager()
+        self._initialized = False
+        # Concurrent first callers wait for one initialization instead of returning before it is done
+        self._init_lock = asyncio.Lock()
         
         # Query classification patterns for routing
         self.sql_patterns = {
@@ -31,16 +52,31 @@ class HRAskPipeline:
             "employee id": "employee_by_id",
             "position": "employees_by_position"
         }
+        # All patterns in one alternation; the group number of a match gives its priority
+        self._classifier = re.compile("|".join(f"({re.escape(pattern)})" for pattern in self.sql_patterns), re.IGNORECASE)
+        self._classifier_types = list(self.sql_patterns.values())
+        # SQL intents that still search the document store when the SQL results alone fill top_k
+        self.hybrid_intents = {"labor_cost"}
+        # Row format templates, built once per SQL result column layout
+        self._row_templates: Dict[tuple, str] = {}
     
     async def initialize(self) -> None:
-        """Initialize all components"""
-        await self.redis_client.connect()
-        await self.sql_executor.connect()
+        """Initialize all components, once; retried on the next call if a connect fails"""
+        async with self._init_lock:
+            if self._initialized:
+                return
+            
+            await self.redis_client.connect()
+            await self.sql_executor.connect()
+            await self.model_manager.startup()
+            self._initialized = True
     
     async def shutdown(self) -> None:
         """Shutdown all components"""
+        self._initialized = False
         await self.redis_client.disconnect()
         await self.sql_executor.disconnect()
+        await self.model_manager.shutdown()
     
     async def process_query(self, query_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -69,6 +105,7 @@ class HRAskPipeline:
             
             documents = []
             sql_results = []
+            sql_intent = None
             
             # For structured queries, use SQL executor
             if query_type.startswith('sql:'):
@@ -80,27 +117,36 @@ class HRAskPipeline:
                     
                     # Convert SQL results to documents for context
                     for idx, result in enumerate(sql_results):
-                        content = "\n".join([f"{k}: {v}" for k, v in result.items()])
+                        content = self._row_content(result)
                         documents.append({
                             "content": content,
                             "meta": {**result, "source": "sql", "idx": idx}
                         })
             
-            # Always retrieve from document store as well (hybrid approach)
-            haystack_docs = await self.haystack_wrapper.retrieve_documents(
-                query=query_text,
-                filters=filters,
-                top_k=top_k
-            )
+            # Role permissions are already part of the retrieval filters; SQL results are filtered here
+            filtered_sql = self.role_validator.apply_document_filters(documents, user)
+            
+            # Retrieve from document store as well (hybrid approach), unless SQL already answered
+            if sql_intent and sql_intent not in self.hybrid_intents and len(filtered_sql) >= top_k:
+                logger.info(f"Skipping document retrieval for query ID {query_id}: {len(filtered_sql)} SQL results for {sql_intent}")
+                haystack_docs = []
+            else:
+                haystack_docs = await self.haystack_wrapper.retrieve_documents(
+                    query=query_text,
+                    filters=filters,
+                    top_k=top_k
+                )
             
             # Combine documents from both sources
             all_docs = haystack_docs + documents
             
-            # Filter documents by role permissions
-            filtered_docs = self.role_validator.apply_document_filters(all_docs, user)
+            filtered_haystack = haystack_docs
+            filtered_docs = filtered_haystack + filtered_sql
             
             # Create context from documents
-            context = self._create_context(filtered_docs)
+            context = self._create_context(
+                [doc.content for doc in filtered_haystack] + [doc["content"] for doc in filtered_sql]
+            )
             
             if not context.strip():
                 response_text = "I don't have access to information relevant to your query."
@@ -148,11 +194,10 @@ class HRAskPipeline:
         Returns:
             'sql:<intent>' for structured queries, 'haystack' for others
         """
-        query_lower = query.lower()
-        
-        for pattern, sql_type in self.sql_patterns.items():
-            if pattern in query_lower:
-                return f"sql:{sql_type}"
+        # Earliest pattern in sql_patterns wins, wherever it occurs in the query
+        group = min((match.lastindex for match in self._classifier.finditer(query)), default=None)
+        if group:
+            return f"sql:{self._classifier_types[group - 1]}"
         
         return "haystack"
     
@@ -163,28 +208,20 @@ class HRAskPipeline:
         This is a simplistic implementation - in production would use NER
         """
         # Simple parameter extraction for demo purposes
-        import re
-        from datetime import datetime
-        
         query_lower = query.lower()
         
         if intent == "employee_shifts":
-            # Extract date
-            date_match = re.search(r'on (\d{1,2}/\d{1,2}/\d{4})', query_lower)
-            if date_match:
-                return [date_match.group(1)]
+            # Extract date, preferring a numeric date anywhere over a month name
+            date_match = None
+            for match in _SHIFT_DATE_RE.finditer(query_lower):
+                if match.group('numeric'):
+                    return [match.group('numeric')]
+                date_match = date_match or match
             
-            # Try more date formats
-            date_match = re.search(r'on (january|february|march|april|may|june|july|august|september|october|november|december) (\d{1,2}),? (\d{4})', query_lower)
             if date_match:
-                month_dict = {
-                    'january': 1, 'february': 2, 'march': 3, 'april': 4,
-                    'may': 5, 'june': 6, 'july': 7, 'august': 8,
-                    'september': 9, 'october': 10, 'november': 11, 'december': 12
-                }
-                month = month_dict[date_match.group(1)]
-                day = int(date_match.group(2))
-                year = int(date_match.group(3))
+                month = _MONTH_NUMBERS[date_match.group('month')]
+                day = int(date_match.group('day'))
+                year = int(date_match.group('year'))
                 return [f"{month}/{day}/{year}"]
             
             # Today as fallback
@@ -192,15 +229,15 @@ class HRAskPipeline:
             
         elif intent == "employee_by_id":
             # Extract employee ID
-            id_match = re.search(r'employee (\w+)', query_lower)
+            id_match = _EMPLOYEE_RE.search(query_lower)
             if id_match:
                 return [id_match.group(1)]
             return None
             
         elif intent == "employees_by_position":
             # Extract position and date
-            position_match = re.search(r'position (\w+)', query_lower)
-            date_match = re.search(r'on (\d{1,2}/\d{1,2}/\d{4})', query_lower)
+            position_match = _POSITION_RE.search(query_lower)
+            date_match = _DATE_RE.search(query_lower)
             
             if position_match and date_match:
                 return [position_match.group(1), date_match.group(1)]
@@ -211,21 +248,16 @@ class HRAskPipeline:
             
         elif intent == "labor_cost":
             # Extract date range
-            start_date_match = re.search(r'from (\d{1,2}/\d{1,2}/\d{4})', query_lower)
-            end_date_match = re.search(r'to (\d{1,2}/\d{1,2}/\d{4})', query_lower)
+            start_date_match = _FROM_DATE_RE.search(query_lower)
+            end_date_match = _TO_DATE_RE.search(query_lower)
             
             if start_date_match and end_date_match:
                 return [start_date_match.group(1), end_date_match.group(1)]
             
             # If only looking at a month
-            month_match = re.search(r'in (january|february|march|april|may|june|july|august|september|october|november|december)', query_lower)
+            month_match = _MONTH_RE.search(query_lower)
             if month_match:
-                month_dict = {
-                    'january': 1, 'february': 2, 'march': 3, 'april': 4,
-                    'may': 5, 'june': 6, 'july': 7, 'august': 8,
-                    'september': 9, 'october': 10, 'november': 11, 'december': 12
-                }
-                month = month_dict[month_match.group(1)]
+                month = _MONTH_NUMBERS[month_match.group(1)]
                 year = datetime.now().year
                 return [f"{month}/1/{year}", f"{month}/28/{year}"]
             
@@ -235,30 +267,40 @@ class HRAskPipeline:
             
         return None
     
-    def _create_context(self, documents: List) -> str:
+    def _row_content(self, row: Mapping[str, Any]) -> str:
+        """Render a SQL result row as 'column: value' lines"""
+        columns = tuple(row.keys())
+        template = self._row_templates.get(columns)
+        if template is None:
+            template = "\n".join(
+                f"{column.replace('{', '{{').replace('}', '}}')}: {{{i}}}" for i, column in enumerate(columns)
+            )
+            self._row_templates[columns] = template
+        return template.format(*row.values())
+    
+    def _create_context(self, contents: List[str]) -> str:
         """
-        Create context string from documents
+        Create context string from document contents
         """
-        context_parts = []
-        
-        for i, doc in enumerate(documents):
-            if hasattr(doc, 'content'):
-                # Haystack Document
-                context_parts.append(f"--- Document {i+1} ---\n{doc.content}")
-            elif isinstance(doc, dict) and 'content' in doc:
-                # Dictionary with content field
-                context_parts.append(f"--- Document {i+1} ---\n{doc['content']}")
-        
-        return "\n\n".join(context_parts)
+        return "\n\n".join(f"--- Document {i} ---\n{content}" for i, content in enumerate(contents, 1))
     
     async def start_pipeline(self) -> None:
         """Start the pipeline to process questions from Redis"""
         await self.initialize()
         
-        async def process_callback(query_data: Dict[str, Any]) -> None:
-            """Callback function for processing queries"""
-            response = await self.process_query(query_data)
-            await self.redis_client.publish_response(response)
+        async def process_callback(batch: List[Dict[str, Any]]) -> None:
+            """Callback function for processing a batch of queries"""
+            results = await asyncio.gather(*(self.process_query(query_data) for query_data in batch), return_exceptions=True)
+            
+            responses = []
+            for query_data, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Error processing query ID {query_data.get('query_id', 'unknown')}: {str(result)}")
+                    continue
+                responses.append((result, query_data.get('reply_to')))
+            
+            # All of the batch's answers go out in a single Redis round-trip
+            await self.redis_client.publish_responses(responses)
         
         try:
             logger.info("Starting pipeline...")
@@ -1,9 +1,15 @@
 from haystack.document_stores.in_memory import InMemoryDocumentStore
 from haystack.components.retrievers.in_memory import InMemoryBM25Retriever
 from haystack import Document
+from haystack.document_stores.types import DuplicatePolicy
 import pandas as pd
 import requests
-import json
+import orjson
+import logging
+import os
+from typing import Iterator, List
+
+logger = logging.getLogger(__name__)
 
 INDEX_NAME = "employee-shifts"
 
@@ -13,28 +19,71 @@ retriever = InMemoryBM25Retriever(document_store=document_store)
 
 OLLAMA_BASE_URL = "http://127.0.0.1:11434"
 
+# One pooled session, so queries reuse the keep-alive connection to Ollama
+_SESSION = requests.Session()
+_SESSION.headers["Connection"] = "keep-alive"
+
+# Ingested documents, appended as JSON lines so a restarted process can answer
+# without re-ingesting; kept in a directory owned by the app rather than /tmp
+BM25_CACHE_DIR = os.getenv("BM25_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".bm25_cache"))
+DOCUMENT_STORE_PATH = os.path.join(BM25_CACHE_DIR, "documents.jsonl")
+
+def _load_documents() -> None:
+    """Restore the saved documents into the document store, if there are any"""
+    if not os.path.exists(DOCUMENT_STORE_PATH):
+        return
+    docs = []
+    try:
+        with open(DOCUMENT_STORE_PATH, "rb") as file:
+            for line in file:
+                try:
+                    docs.append(Document.from_dict(orjson.loads(line)))
+                except orjson.JSONDecodeError:
+                    # A write cut short leaves at most a partial last line
+                    logger.warning(f"Skipping unreadable line in {DOCUMENT_STORE_PATH}")
+        document_store.write_documents(docs, policy=DuplicatePolicy.SKIP)
+    except Exception as e:
+        logger.error(f"Could not load documents from {DOCUMENT_STORE_PATH}: {e}")
+
+def _save_documents(docs: List[Document]) -> None:
+    """Append newly written documents to the saved copy of the store"""
+    os.makedirs(BM25_CACHE_DIR, exist_ok=True)
+    with open(DOCUMENT_STORE_PATH, "ab") as file:
+        file.write(b"".join(orjson.dumps(doc.to_dict()) + b"\n" for doc in docs))
+
+_load_documents()
+
 def ingest_csv(file_path: str):
     """Ingest CSV file into Elasticsearch document store"""
     df = pd.read_csv(file_path)
     docs = []
-    for idx, row in df.iterrows():
+    cols = list(df.columns)
+    # Missing values and string forms found once for the whole frame, not per cell
+    notna = df.notna().to_numpy()
+    vals = df.astype(str).to_numpy(dtype=object)
+    for idx, row_vals, row_mask in zip(df.index, vals, notna):
+        row = {col: val for col, val, present in zip(cols, row_vals, row_mask) if present}
         # Create more structured content from CSV row
-        content = "\n".join([f"{col}: {val}" for col, val in row.items() if pd.notna(val)])
+        content = "\n".join([f"{col}: {val}" for col, val in row.items()])
         doc = Document(
             content=content, 
             meta={
                 "source": "csv",
                 "row_id": idx,
-                **{col: str(val) for col, val in row.items() if pd.notna(val)}
+                **row
             }
         )
         docs.append(doc)
     
-    document_store.write_documents(docs)
-    return len(docs)
+    # IDs hash content and meta, so rows ingested before are skipped rather than duplicated
+    new_docs = [doc for doc in {doc.id: doc for doc in docs}.values() if doc.id not in document_store.storage]
+    document_store.write_documents(new_docs, policy=DuplicatePolicy.SKIP)
+    if new_docs:
+        _save_documents(new_docs)
+    return len(new_docs)
 
-def ask_llm_ollama(query: str, top_k: int = 5) -> str:
-    """Query LLM using Ollama instead of OpenAI"""
+def stream_llm_ollama(query: str, top_k: int = 5) -> Iterator[str]:
+    """Query LLM using Ollama, yielding the answer's tokens as they are generated"""
     docs = retriever.run(query=query, top_k=top_k)["documents"]
     context = "\n\n".join([doc.content for doc in docs])
     
@@ -50,22 +99,36 @@ Answer:"""
     payload = {
         "model": "llama3.1:8b",
         "prompt": prompt,
-        "stream": False,
+        "stream": True,
         "options": {
             "temperature": 0.1,
             "num_predict": 150
         }
     }
     
-    try:
-        response = requests.post(
-            f"{OLLAMA_BASE_URL}/api/generate",
-            json=payload,
-            timeout=100  # Reduced timeout for 8b model
-        )
+    with _SESSION.post(
+        f"{OLLAMA_BASE_URL}/api/generate",
+        data=orjson.dumps(payload),
+        headers={"Content-Type": "application/json"},
+        timeout=100,  # Reduced timeout for 8b model
+        stream=True
+    ) as response:
         response.raise_for_status()
-        result = response.json()
-        return result.get("response", "No response generated")
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = orjson.loads(line)
+            if "error" in chunk:
+                raise RuntimeError(chunk["error"])
+            if chunk.get("response"):
+                yield chunk["response"]
+            if chunk.get("done"):
+                break
+
+def ask_llm_ollama(query: str, top_k: int = 5) -> str:
+    """Query LLM using Ollama instead of OpenAI"""
+    try:
+        return "".join(stream_llm_ollama(query, top_k)) or "No response generated"
     except Exception as e:
         return f"Error querying Ollama: {str(e)}"
 
@@ -4,23 +4,33 @@ import os
 import json
 import uuid
 import time
-import redis
+import orjson
 import requests
-from query import ask_llm, ingest_csv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from query import ingest_csv, stream_llm_ollama
 
-# Redis connection
+API_URL = os.getenv('INGESTION_API_URL', 'http://ingestion_api:8080')
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# One keep-alive connection pool to the API, shared by every session and rerun
 @st.cache_resource
-def get_redis_client():
-    return redis.Redis(
-        host=os.getenv('REDIS_HOST', 'redis'),
-        port=int(os.getenv('REDIS_PORT', 6379)),
-        decode_responses=True
-    )
+def get_http_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=50, pool_maxsize=50, max_retries=Retry(total=3, backoff_factor=0.1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Queries wait for their answers on these threads rather than the script run,
+# so a rerun from any widget interaction doesn't drop a pending answer
+@st.cache_resource
+def get_query_executor():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="hrask-query")
 
 def submit_query_via_api(query: str, user_role: str = "employee", user_id: str = ""):
     """Submit query via API /query endpoint"""
-    api_url = os.getenv('INGESTION_API_URL', 'http://ingestion_api:8080')
-    
     query_data = {
         "query": query,
         "user_role": user_role,
@@ -29,9 +39,9 @@ def submit_query_via_api(query: str, user_role: str = "employee", user_id: str =
     }
     
     try:
-        response = requests.post(f"{api_url}/query", json=query_data, timeout=30)
+        response = get_http_session().post(f"{API_URL}/query", data=orjson.dumps(query_data), headers=JSON_HEADERS, timeout=30)
         if response.status_code == 200:
-            return response.json()
+            return orjson.loads(response.content)
         else:
             return {"success": False, "error": f"API Error: {response.status_code}"}
     except Exception as e:
@@ -39,8 +49,6 @@ def submit_query_via_api(query: str, user_role: str = "employee", user_id: str =
 
 def submit_query_via_direct_api(query: str, user_role: str = "employee", user_id: str = ""):
     """Submit query via API /query/direct endpoint (bypass Redis)"""
-    api_url = os.getenv('INGESTION_API_URL', 'http://ingestion_api:8080')
-    
     query_data = {
         "query": query,
         "user_role": user_role,
@@ -49,14 +57,40 @@ def submit_query_via_direct_api(query: str, user_role: str = "employee", user_id
     }
     
     try:
-        response = requests.post(f"{api_url}/query/direct", json=query_data, timeout=30)
+        response = get_http_session().post(f"{API_URL}/query/direct", data=orjson.dumps(query_data), headers=JSON_HEADERS, timeout=30)
         if response.status_code == 200:
-            return response.json()
+            return orjson.loads(response.content)
         else:
             return {"success": False, "error": f"API Error: {response.status_code}"}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+def fetch_health(api_url: str):
+    """API health data, {} when the API answers with an error, None when it can't be reached"""
+    try:
+        response = get_http_session().get(f"{api_url}/health", timeout=5)
+        return orjson.loads(response.content) if response.status_code == 200 else {}
+    except Exception:
+        return None
+
+def fetch_stats(api_url: str):
+    """API statistics, or None when they can't be fetched"""
+    try:
+        response = get_http_session().get(f"{api_url}/stats", timeout=5)
+        return orjson.loads(response.content) if response.status_code == 200 else None
+    except Exception:
+        return None
+
+# Sidebar probes are reused across reruns for 10 seconds, failures included,
+# so widget interactions don't each hit the API
+@st.cache_data(ttl=10, show_spinner=False)
+def fetch_status(api_url: str):
+    """Health and stats, requested concurrently"""
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        health = executor.submit(fetch_health, api_url)
+        stats = fetch_stats(api_url)
+        return health.result(), stats
+
 st.set_page_config(page_title="HR Assistant with API", layout="wide")
 
 st.title("🏢 HR Assistant - API Integration")
@@ -65,30 +99,22 @@ st.markdown("Upload CSV files and ask questions about employee data via API endp
 # Sidebar for system status
 with st.sidebar:
     st.header("System Status")
+    health_data, stats = fetch_status(API_URL)
     
     # Check API health
-    try:
-        api_url = os.getenv('INGESTION_API_URL', 'http://ingestion_api:8080')
-        api_response = requests.get(f"{api_url}/health", timeout=5)
-        if api_response.status_code == 200:
-            health_data = api_response.json()
-            st.success(f"✅ API: {health_data['status']}")
-            st.info(f"Redis: {health_data.get('redis', 'unknown')}")
-            st.info(f"Document Store: {health_data.get('document_store', 'unknown')}")
-        else:
-            st.error("❌ API not responding")
-    except:
+    if health_data is None:
         st.warning("⚠️ Cannot reach API")
+    elif health_data:
+        st.success(f"✅ API: {health_data.get('status', 'unknown')}")
+        st.info(f"Redis: {health_data.get('redis', 'unknown')}")
+        st.info(f"Document Store: {health_data.get('document_store', 'unknown')}")
+    else:
+        st.error("❌ API not responding")
     
-    # Get stats
-    try:
-        stats_response = requests.get(f"{api_url}/stats", timeout=5)
-        if stats_response.status_code == 200:
-            stats = stats_response.json()
-            st.metric("Documents in Store", stats.get('documents_in_store', 0))
-            st.metric("Pending Queries", stats.get('pending_queries', 0))
-    except:
-        pass
+    # Show stats
+    if stats:
+        st.metric("Documents in Store", stats.get('documents_in_store', 0))
+        st.metric("Pending Queries", stats.get('pending_queries', 0))
 
 # Main interface
 col1, col2 = st.columns([1, 1])
@@ -100,10 +126,9 @@ with col1:
     if st.button("📤 Ingest Existing CSV Files"):
         with st.spinner("Ingesting existing CSV files..."):
             try:
-                api_url = os.getenv('INGESTION_API_URL', 'http://ingestion_api:8080')
-                api_response = requests.post(f"{api_url}/ingest/existing", timeout=30)
+                api_response = get_http_session().post(f"{API_URL}/ingest/existing", timeout=30)
                 if api_response.status_code == 200:
-                    result = api_response.json()
+                    result = orjson.loads(api_response.content)
                     st.success(f"✅ Ingested {result['total_documents_ingested']} documents")
                     
                     for file_result in result['results']:
@@ -123,15 +148,16 @@ with col1:
     if uploaded_files and st.button("📤 Upload and Ingest"):
         with st.spinner("Uploading and ingesting files..."):
             try:
-                api_url = os.getenv('INGESTION_API_URL', 'http://ingestion_api:8080')
                 files_data = []
                 for uploaded_file in uploaded_files:
-                    files_data.append(("files", (uploaded_file.name, uploaded_file.getvalue(), "text/csv")))
+                    # Hand over the file object itself rather than a bytes copy of it
+                    uploaded_file.seek(0)
+                    files_data.append(("files", (uploaded_file.name, uploaded_file, "text/csv")))
                 
-                api_response = requests.post(f"{api_url}/upload/csv", files=files_data, timeout=60)
+                api_response = get_http_session().post(f"{API_URL}/upload/csv", files=files_data, timeout=60)
                 
                 if api_response.status_code == 200:
-                    result = api_response.json()
+                    result = orjson.loads(api_response.content)
                     
                     for file_result in result['results']:
                         if file_result['success']:
@@ -173,53 +199,75 @@ with col2:
     with col2b:
         use_direct = st.checkbox("Use Direct Query", value=False, help="Use direct document store query")
     
+    def answer_via_direct_api(query: str, user_role: str, user_id: str):
+        """Show the direct API answer, falling back to a local query"""
+        response = submit_query_via_direct_api(query, user_role, user_id)
+        
+        if response.get("success"):
+            st.success("✅ Direct API Answer:")
+            st.write(response["response"])
+            if response.get("documents_found"):
+                st.info(f"📄 Found {response['documents_found']} relevant documents")
+        else:
+            st.error(f"❌ Direct API Error: {response.get('error', 'Unknown error')}")
+            
+            # Final fallback to local query
+            st.warning("Trying local fallback method...")
+            try:
+                st.success("✅ Local Fallback Answer:")
+                # Show the answer as it is generated
+                answer_box = st.empty()
+                fallback_response = ""
+                for token in stream_llm_ollama(query):
+                    fallback_response += token
+                    answer_box.write(fallback_response)
+            except Exception as e:
+                st.error(f"❌ All methods failed: {str(e)}")
+    
     if st.button("🔍 Ask Question"):
         if query.strip():
-            with st.spinner("Processing your question..."):
-                response = None
-                
-                if use_redis:
-                    # Use Redis queue via API
-                    response = submit_query_via_api(query, user_role, user_id)
-                    
-                    if response.get("success"):
-                        st.success("✅ Answer from Redis Queue API:")
-                        st.write(response["response"])
-                        if response.get("documents_found"):
-                            st.info(f"📄 Found {response['documents_found']} relevant documents")
-                    else:
-                        st.error(f"❌ Redis API Error: {response.get('error', 'Unknown error')}")
-                        
-                        # Fallback to direct API if Redis fails
-                        if use_direct:
-                            st.warning("Trying direct API method...")
-                            response = submit_query_via_direct_api(query, user_role, user_id)
-                
-                if use_direct and (not use_redis or not response or not response.get("success")):
-                    # Use direct API query method
-                    response = submit_query_via_direct_api(query, user_role, user_id)
-                    
-                    if response.get("success"):
-                        st.success("✅ Direct API Answer:")
-                        st.write(response["response"])
-                        if response.get("documents_found"):
-                            st.info(f"📄 Found {response['documents_found']} relevant documents")
-                    else:
-                        st.error(f"❌ Direct API Error: {response.get('error', 'Unknown error')}")
-                        
-                        # Final fallback to local query
-                        st.warning("Trying local fallback method...")
-                        try:
-                            fallback_response = ask_llm(query)
-                            st.success("✅ Local Fallback Answer:")
-                            st.write(fallback_response)
-                        except Exception as e:
-                            st.error(f"❌ All methods failed: {str(e)}")
-                
-                if not use_redis and not use_direct:
-                    st.warning("Please select at least one query method")
+            if use_redis:
+                # Use Redis queue via API; the answer is picked up below, on this run or a later one
+                st.session_state["pending_query"] = {
+                    "future": get_query_executor().submit(submit_query_via_api, query, user_role, user_id),
+                    "query": query,
+                    "user_role": user_role,
+                    "user_id": user_id,
+                    "use_direct": use_direct
+                }
+            elif use_direct:
+                with st.spinner("Processing your question..."):
+                    answer_via_direct_api(query, user_role, user_id)
+            else:
+                st.warning("Please select at least one query method")
         else:
             st.warning("Please enter a question")
+    
+    pending = st.session_state.get("pending_query")
+    if pending:
+        # Each status update is a point where Streamlit can stop this run for a rerun;
+        # the future stays in session_state, so the next run resumes the wait
+        status = st.empty()
+        while not pending["future"].done():
+            status.info(f"⏳ Processing your question: {pending['query'][:80]}")
+            time.sleep(0.25)
+        status.empty()
+        del st.session_state["pending_query"]
+        
+        response = pending["future"].result()
+        if response.get("success"):
+            st.success("✅ Answer from Redis Queue API:")
+            st.write(response["response"])
+            if response.get("documents_found"):
+                st.info(f"📄 Found {response['documents_found']} relevant documents")
+        else:
+            st.error(f"❌ Redis API Error: {response.get('error', 'Unknown error')}")
+            
+            # Fallback to direct API if Redis fails
+            if pending["use_direct"]:
+                st.warning("Trying direct API method...")
+                with st.spinner("Processing your question..."):
+                    answer_via_direct_api(pending["query"], pending["user_role"], pending["user_id"])
 
 # Example queries section
 with st.expander("📋 Example Queries"):
@@ -2,9 +2,11 @@
 Redis client module for HRAsk system - async pub/sub
 """
 import os
-import json
+import socket
+import asyncio
+import orjson
 import logging
-from typing import Dict, Any, Optional, Callable, Awaitable
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable
 import redis.asyncio as redis_async
 
 logger = logging.getLogger(__name__)
@@ -14,67 +16,203 @@ class RedisAsyncClient:
         """Initialize Redis async client with connection from env vars"""
         self.host = os.getenv('REDIS_HOST', 'redis')
         self.port = int(os.getenv('REDIS_PORT', 6379))
+        self.max_connections = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
         self._redis_client = None
-        self.ask_queue = "hrask.ask.queue"
+        # Concurrent first uses share one connection attempt instead of each creating a client
+        self._connect_lock = asyncio.Lock()
+        # Questions arrive on a stream read through a consumer group, acknowledged once answered
+        self.ask_stream = "hrask.ask.stream"
+        self.ask_group = "hrask.workers"
+        self.consumer_name = os.getenv('REDIS_CONSUMER_NAME', socket.gethostname())
         self.response_queue = "hrask.response.queue"
+        self.reply_ttl = int(os.getenv('REPLY_TTL', 60))
+        # Questions taken off the ask stream per read and handed to the callback as one batch
+        self.query_batch_size = int(os.getenv('QUERY_BATCH_SIZE', 32))
+        # Questions left unacknowledged this long (a failed batch, or a consumer that died) are claimed again
+        self.claim_idle_ms = int(os.getenv('PENDING_CLAIM_IDLE_MS', 60000))
+        # Milliseconds a read waits for new questions before checking for idle ones to claim
+        self.read_block_ms = 5000
     
     async def connect(self) -> None:
-        """Connect to Redis server"""
-        self._redis_client = await redis_async.Redis(
-            host=self.host,
-            port=self.port,
-            decode_responses=True
-        )
-        logger.info(f"Connected to Redis at {self.host}:{self.port}")
+        """Connect to Redis server, once"""
+        async with self._connect_lock:
+            if self._redis_client:
+                return
+            
+            # Bounded pool, so concurrent commands run on parallel connections (which a
+            # multi-threaded server such as Dragonfly can serve on separate cores)
+            pool = redis_async.ConnectionPool(
+                host=self.host,
+                port=self.port,
+                max_connections=self.max_connections
+            )
+            self._redis_client = await redis_async.Redis(connection_pool=pool)
+            logger.info(f"Connected to Redis at {self.host}:{self.port}")
     
     async def disconnect(self) -> None:
         """Disconnect from Redis server"""
         if self._redis_client:
-            await self._redis_client.close()
+            # The pool was passed in, so it is only closed when asked for explicitly
+            await self._redis_client.close(close_connection_pool=True)
+            self._redis_client = None
             logger.info("Disconnected from Redis")
     
-    async def publish_response(self, response_data: Dict[str, Any]) -> None:
-        """Publish structured response to the response queue"""
+    async def publish_response(self, response_data: Dict[str, Any], reply_to: Optional[str] = None) -> None:
+        """Publish structured response to the query's reply key, or the response queue"""
         if not self._redis_client:
             await self.connect()
         
         try:
-            response_json = json.dumps(response_data)
-            await self._redis_client.rpush(self.response_queue, response_json)
+            response_json = orjson.dumps(response_data)
+            if reply_to:
+                # Expire the reply key in case the caller has given up waiting
+                async with self._redis_client.pipeline(transaction=False) as pipe:
+                    pipe.rpush(reply_to, response_json)
+                    pipe.expire(reply_to, self.reply_ttl)
+                    await pipe.execute()
+            else:
+                await self._redis_client.rpush(self.response_queue, response_json)
             logger.info(f"Published response for query ID: {response_data.get('query_id', 'unknown')}")
         except Exception as e:
             logger.error(f"Error publishing response: {str(e)}")
     
-    async def subscribe_to_questions(self, callback: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+    async def publish_responses(self, responses: List[Tuple[Dict[str, Any], Optional[str]]]) -> None:
+        """Publish a batch of (response, reply_to) pairs in one pipelined round-trip"""
+        if not responses:
+            return
+        if not self._redis_client:
+            await self.connect()
+        
+        try:
+            queued = []
+            async with self._redis_client.pipeline(transaction=False) as pipe:
+                for response_data, reply_to in responses:
+                    response_json = orjson.dumps(response_data)
+                    if reply_to:
+                        pipe.rpush(reply_to, response_json)
+                        pipe.expire(reply_to, self.reply_ttl)
+                    else:
+                        queued.append(response_json)
+                # Responses for the shared queue go in one variadic RPUSH
+                if queued:
+                    pipe.rpush(self.response_queue, *queued)
+                await pipe.execute()
+            logger.info(f"Published {len(responses)} responses")
+        except Exception as e:
+            # Raised so the caller leaves the questions unacknowledged, to be answered again
+            logger.error(f"Error publishing responses: {str(e)}")
+            raise
+    
+    async def _ensure_ask_group(self) -> None:
+        """Create the ask stream's consumer group, starting from the oldest question"""
+        try:
+            await self._redis_client.xgroup_create(self.ask_stream, self.ask_group, id="0", mkstream=True)
+        except redis_async.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+    
+    async def _claim_idle(self) -> list:
+        """Take over questions left pending in the group for longer than claim_idle_ms"""
+        claimed = await self._redis_client.xautoclaim(
+            self.ask_stream, self.ask_group, self.consumer_name,
+            min_idle_time=self.claim_idle_ms, start_id="0-0", count=self.query_batch_size
+        )
+        return claimed[1]
+    
+    def _decode_batch(self, messages: list) -> Tuple[List[Dict[str, Any]], list, list]:
         """
-        Subscribe to incoming questions and process with callback
+        Split stream entries into the decoded questions, their IDs, and the IDs
+        of entries with nothing to answer (trimmed from the stream or undecodable)
+        """
+        batch = []
+        batch_ids = []
+        dropped_ids = []
+        for message_id, fields in messages:
+            # Trimmed from the stream (MAXLEN) while still pending: nothing left to answer
+            if not fields:
+                logger.warning(f"Skipping trimmed message {message_id}")
+                dropped_ids.append(message_id)
+                continue
+            message_data = fields.get(b"data")
+            try:
+                query_data = orjson.loads(message_data)
+                if not isinstance(query_data, dict):
+                    raise TypeError(f"expected a JSON object, got {type(query_data).__name__}")
+            except (orjson.JSONDecodeError, TypeError):
+                logger.error(f"Invalid JSON message: {message_data}")
+                dropped_ids.append(message_id)
+                continue
+            logger.info(f"Received question: {str(query_data.get('query', ''))[:50]}...")
+            batch.append(query_data)
+            batch_ids.append(message_id)
+        
+        # XAUTOCLAIM reports entries deleted from the stream without an ID
+        return batch, batch_ids, [message_id for message_id in dropped_ids if message_id is not None]
+    
+    async def subscribe_to_questions(self, callback: Callable[[List[Dict[str, Any]]], Awaitable[None]]) -> None:
+        """
+        Subscribe to incoming questions and process with callback.
+        Questions already waiting are taken and handed over in batches, and
+        acknowledged once the callback returns. If it raises, the batch stays
+        pending and is answered again: re-read after a restart, or claimed once
+        it has been idle for claim_idle_ms. Runs until cancelled.
         
         Args:
-            callback: Async function that processes the question
+            callback: Async function that processes a batch of questions
         """
         if not self._redis_client:
             await self.connect()
         
-        logger.info(f"Subscribing to queue: {self.ask_queue}")
+        logger.info(f"Subscribing to stream: {self.ask_stream} as {self.consumer_name}")
         
-        try:
-            while True:
-                # Use blocking list pop with timeout
-                message = await self._redis_client.blpop(self.ask_queue, timeout=1)
+        # Questions this consumer took but never acknowledged (e.g. before a restart) come first
+        last_id = "0"
+        next_claim = 0.0
+        while True:
+            try:
+                messages = []
+                loop_time = asyncio.get_running_loop().time()
+                if last_id == ">" and loop_time >= next_claim:
+                    next_claim = loop_time + self.claim_idle_ms / 1000
+                    messages = await self._claim_idle()
+                
+                if not messages:
+                    # Take up to a batch of messages in one round-trip, blocking while the stream is empty
+                    entries = await self._redis_client.xreadgroup(
+                        self.ask_group, self.consumer_name, {self.ask_stream: last_id},
+                        count=self.query_batch_size, block=None if last_id == "0" else self.read_block_ms
+                    )
+                    messages = entries[0][1] if entries else []
+                
+                if not messages:
+                    last_id = ">"
+                    continue
                 
-                if message:
-                    _, message_data = message
+                batch, batch_ids, dropped_ids = self._decode_batch(messages)
+                if dropped_ids:
+                    await self._redis_client.xack(self.ask_stream, self.ask_group, *dropped_ids)
+                
+                if batch:
                     try:
-                        query_data = json.loads(message_data)
-                        logger.info(f"Received question: {query_data.get('query', '')[:50]}...")
-                        await callback(query_data)
-                    except json.JSONDecodeError:
-                        logger.error(f"Invalid JSON message: {message_data}")
+                        await callback(batch)
                     except Exception as e:
-                        logger.error(f"Error processing message: {str(e)}")
-        except Exception as e:
-            logger.error(f"Subscription error: {str(e)}")
-            raise
+                        logger.error(f"Error processing messages, leaving them pending: {str(e)}")
+                        await asyncio.sleep(1)  # Wait before retrying
+                        continue
+                    await self._redis_client.xack(self.ask_stream, self.ask_group, *batch_ids)
+                    
+            except asyncio.CancelledError:
+                raise
+            except redis_async.ResponseError as e:
+                if "NOGROUP" not in str(e):
+                    logger.error(f"Subscription error: {str(e)}")
+                    await asyncio.sleep(1)  # Wait before retrying
+                    continue
+                # First run, or the stream was removed: create the group and read again
+                await self._ensure_ask_group()
+            except Exception as e:
+                logger.error(f"Subscription error: {str(e)}")
+                await asyncio.sleep(1)  # Wait before retrying
     
     async def is_healthy(self) -> bool:
         """Check if Redis connection is healthy"""
@@ -1,12 +1,20 @@
 """
 Role validator module for HRAsk system - validates user roles and creates filters
 """
+import os
 import logging
-from typing import Dict, Any, List, Optional
-from dataclasses import dataclass
+from typing import Dict, Any, Callable, List, Optional
+from dataclasses import dataclass, field
+from cachetools import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Data types every role may read
+_PUBLIC_DATA_TYPES = frozenset({"sales_breakdown", "public"})
+
+# Matches no document, for roles whose access rules grant nothing
+_NO_DOCUMENTS = {"field": "id", "operator": "in", "value": []}
+
 @dataclass
 class User:
     """User data class for role validation"""
@@ -15,6 +23,13 @@ class User:
     account_id: Optional[str] = None
     accessible_locations: Optional[List[str]] = None
     team_employees: Optional[List[str]] = None
+    # Lowercased team and locations, computed once for matching against document meta
+    team_keys: frozenset = field(init=False, repr=False)
+    location_keys: frozenset = field(init=False, repr=False)
+    
+    def __post_init__(self):
+        self.team_keys = frozenset(e.lower() for e in self.team_employees or ())
+        self.location_keys = frozenset(loc.lower() for loc in self.accessible_locations or ())
 
 class RoleValidator:
     def __init__(self):
@@ -26,6 +41,12 @@ class RoleValidator:
             "manager": 3,
             "admin": 4
         }
+        
+        # Team lookups per (user_id, role); the TTL lets membership changes show up
+        self.team_cache = TTLCache(
+            maxsize=int(os.getenv('TEAM_CACHE_SIZE', 1024)),
+            ttl=int(os.getenv('TEAM_CACHE_TTL', 60))
+        )
     
     def validate_role(self, query_data: Dict[str, Any]) -> User:
         """
@@ -46,14 +67,18 @@ class RoleValidator:
             role = 'employee'
         
         # Get team members (in real app, would query a database)
-        team_members = self._get_team_members(user_id, role)
+        cache_key = (user_id, role)
+        team_members = self.team_cache.get(cache_key)
+        if team_members is None:
+            team_members = tuple(self._get_team_members(user_id, role))
+            self.team_cache[cache_key] = team_members
         
         return User(
             user_id=user_id,
             role=role,
             account_id=account_id,
             accessible_locations=location_ids,
-            team_employees=team_members
+            team_employees=list(team_members)
         )
     
     def _get_team_members(self, user_id: str, role: str) -> List[str]:
@@ -77,23 +102,73 @@ class RoleValidator:
     
     def create_filters(self, user: User) -> Dict[str, Any]:
         """
-        Create filters for document retrieval based on user role
+        Create filters for document retrieval based on user role, in Haystack 2
+        filter syntax so the document store applies them while retrieving
+        """
+        # Only role permissions: documents carry no account, location or employee ID meta,
+        # so the team and location restrictions are matched on the employee and location
+        # columns ingest writes (employee_key/location_key)
+        return self._access_filter(user) or {}
+    
+    def _access_filter(self, user: User) -> Optional[Dict[str, Any]]:
         """
-        filters = {}
+        The rules of apply_document_filters as a Haystack filter, matching the
+        lowercased employee_key/location_key meta written by HaystackWrapper.
+        None when the role sees everything.
+        """
+        if user.role == 'admin':
+            return None
+        
+        public = {"field": "meta.data_type", "operator": "in", "value": list(_PUBLIC_DATA_TYPES)}
+        
+        if user.role == 'employee' and user.user_id:
+            own = {"field": "meta.employee_key", "operator": "==", "value": user.user_id.lower()}
+            return {"operator": "OR", "conditions": [own, public]}
+        
+        elif user.role == 'supervisor' and user.team_employees:
+            team = {"field": "meta.employee_key", "operator": "in", "value": sorted(user.team_keys)}
+            return {"operator": "OR", "conditions": [team, public]}
+        
+        elif user.role == 'manager' and user.accessible_locations:
+            return {"operator": "OR", "conditions": [
+                {"field": "meta.location", "operator": "==", "value": None},
+                {"field": "meta.location", "operator": "==", "value": ""},
+                {"field": "meta.location_key", "operator": "in", "value": sorted(user.location_keys)},
+                public
+            ]}
         
-        # Apply account isolation
-        if user.account_id:
-            filters["account_id"] = user.account_id
+        return _NO_DOCUMENTS
+    
+    def _predicate_for(self, user: User) -> Optional[Callable[[Dict[str, Any]], bool]]:
+        """
+        The document meta test for this user's role, chosen once per call of
+        apply_document_filters. None when the role grants no documents.
+        """
+        # Employee filtering - employees only see their own data, or general sales/public data
+        if user.role == 'employee' and user.user_id:
+            user_key = user.user_id.lower()
+            return lambda meta: (meta.get('employee', '').lower() == user_key or
+                                 meta.get('data_type') in _PUBLIC_DATA_TYPES)
         
-        # Location-based filtering
-        if user.accessible_locations:
-            filters["location_id"] = {"$in": user.accessible_locations}
+        # Supervisor filtering - supervisors see team data
+        elif user.role == 'supervisor' and user.team_employees:
+            team_keys = user.team_keys
+            return lambda meta: (meta.get('employee', '').lower() in team_keys or
+                                 meta.get('data_type') in _PUBLIC_DATA_TYPES)
         
-        # Employee-based filtering
-        if user.role != 'admin' and user.team_employees:
-            filters["employee_id"] = {"$in": user.team_employees}
+        # Manager filtering - managers see location data
+        elif user.role == 'manager' and user.accessible_locations:
+            location_keys = user.location_keys
+            
+            def manager_predicate(meta: Dict[str, Any]) -> bool:
+                location = meta.get('location', '')
+                return (not location or
+                        location.lower() in location_keys or
+                        meta.get('data_type') in _PUBLIC_DATA_TYPES)
+            
+            return manager_predicate
         
-        return filters
+        return None
     
     def apply_document_filters(self, docs: List[Any], user: User) -> List[Any]:
         """
@@ -102,30 +177,8 @@ class RoleValidator:
         if user.role == 'admin':
             return docs  # Admins see everything
         
-        filtered_docs = []
-        for doc in docs:
-            meta = getattr(doc, 'meta', {})
-            
-            # Employee filtering - employees only see their own data
-            if user.role == 'employee' and user.user_id:
-                if meta.get('employee', '').lower() == user.user_id.lower():
-                    filtered_docs.append(doc)
-                # Or general sales/public data
-                elif meta.get('data_type') in ['sales_breakdown', 'public']:
-                    filtered_docs.append(doc)
-            
-            # Supervisor filtering - supervisors see team data
-            elif user.role == 'supervisor' and user.team_employees:
-                if (meta.get('employee', '').lower() in [e.lower() for e in user.team_employees] or
-                    meta.get('data_type') in ['sales_breakdown', 'public']):
-                    filtered_docs.append(doc)
-            
-            # Manager filtering - managers see location data
-            elif user.role == 'manager' and user.accessible_locations:
-                location = meta.get('location', '')
-                if (not location or 
-                    location.lower() in [loc.lower() for loc in user.accessible_locations] or
-                    meta.get('data_type') in ['sales_breakdown', 'public']):
-                    filtered_docs.append(doc)
-            
-        return filtered_docs
\ No newline at end of file
+        predicate = self._predicate_for(user)
+        if predicate is None:
+            return []
+        
+        return [doc for doc in docs if predicate(getattr(doc, 'meta', {}))]
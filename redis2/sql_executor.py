@@ -2,15 +2,31 @@
 SQL Executor module for HRAsk system - PostgreSQL integration with asyncpg
 """
 import os
+import asyncio
 import json
 import logging
-from typing import Dict, Any, List, Optional, Union
+from typing import List, Optional, Union
 import asyncpg
 import pandas as pd
+import pyarrow.parquet as pq
 from haystack import Document
 
 logger = logging.getLogger(__name__)
 
+# Column sets that mark a result's data type, checked in order after employee columns
+_DATA_TYPE_RULES = (
+    (frozenset({"date", "position"}), "shift"),
+    (frozenset({"date", "labor_cost"}), "labor_cost")
+)
+
+def _quote_ident(name: str) -> str:
+    """Quote an identifier as COPY does, so CREATE TABLE and INSERT name the same columns"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _text_rows(rows) -> List[tuple]:
+    """Rows with every non-null value as a string, for the TEXT columns ingest_from_file creates"""
+    return [tuple(None if value is None else str(value) for value in row) for row in rows]
+
 class SQLExecutor:
     def __init__(self):
         """Initialize PostgreSQL executor with connection details from env vars"""
@@ -19,7 +35,14 @@ class SQLExecutor:
         self.user = os.getenv('POSTGRES_USER', 'postgres')
         self.password = os.getenv('POSTGRES_PASSWORD', 'postgres')
         self.database = os.getenv('POSTGRES_DB', 'hrask')
+        self.pool_min_size = int(os.getenv('POSTGRES_POOL_MIN_SIZE', 4))
+        self.pool_max_size = int(os.getenv('POSTGRES_POOL_MAX_SIZE', 32))
+        self.statement_cache_size = int(os.getenv('POSTGRES_STATEMENT_CACHE_SIZE', 128))
+        self.command_timeout = float(os.getenv('POSTGRES_COMMAND_TIMEOUT', 30))
+        self.file_batch_size = int(os.getenv('FILE_INGEST_BATCH_SIZE', 10000))
         self._pool = None
+        # Concurrent first uses share one pool creation
+        self._connect_lock = asyncio.Lock()
         
         # Map query intents to SQL templates
         self.query_templates = {
@@ -51,24 +74,31 @@ class SQLExecutor:
         }
     
     async def connect(self) -> None:
-        """Connect to PostgreSQL database"""
-        if self._pool:
-            return
+        """Connect to PostgreSQL database, once"""
+        async with self._connect_lock:
+            if self._pool:
+                return
             
-        try:
-            self._pool = await asyncpg.create_pool(
-                host=self.host,
-                port=self.port,
-                user=self.user,
-                password=self.password,
-                database=self.database,
-                min_size=1,
-                max_size=10
-            )
-            logger.info(f"Connected to PostgreSQL at {self.host}:{self.port}")
-        except Exception as e:
-            logger.error(f"Failed to connect to PostgreSQL: {str(e)}")
-            raise
+            try:
+                self._pool = await asyncpg.create_pool(
+                    host=self.host,
+                    port=self.port,
+                    user=self.user,
+                    password=self.password,
+                    database=self.database,
+                    min_size=self.pool_min_size,
+                    max_size=self.pool_max_size,
+                    # Each connection keeps its prepared statements, keyed by SQL text,
+                    # so a template is parsed and planned once per connection
+                    statement_cache_size=self.statement_cache_size,
+                    # Idle connections are recycled, and a stuck query can't pin a connection forever
+                    max_inactive_connection_lifetime=300,
+                    command_timeout=self.command_timeout
+                )
+                logger.info(f"Connected to PostgreSQL at {self.host}:{self.port}")
+            except Exception as e:
+                logger.error(f"Failed to connect to PostgreSQL: {str(e)}")
+                raise
     
     async def disconnect(self) -> None:
         """Disconnect from PostgreSQL database"""
@@ -77,20 +107,19 @@ class SQLExecutor:
             self._pool = None
             logger.info("Disconnected from PostgreSQL")
     
-    async def execute_query(self, query: str, params: List = None) -> List[Dict[str, Any]]:
-        """Execute SQL query and return results as list of dictionaries"""
+    async def execute_query(self, query: str, params: List = None) -> List[asyncpg.Record]:
+        """Execute SQL query and return the result rows, which support lookup by column name"""
         if not self._pool:
             await self.connect()
         
         try:
             async with self._pool.acquire() as conn:
-                result = await conn.fetch(query, *(params or []))
-                return [dict(row) for row in result]
+                return await conn.fetch(query, *(params or []))
         except Exception as e:
             logger.error(f"Query execution error: {str(e)}")
             return []
     
-    async def process_structured_query(self, query_intent: str, params: List) -> List[Dict[str, Any]]:
+    async def process_structured_query(self, query_intent: str, params: List) -> List[asyncpg.Record]:
         """Process structured query using predefined templates"""
         if query_intent not in self.query_templates:
             logger.error(f"Unknown query intent: {query_intent}")
@@ -114,6 +143,16 @@ class SQLExecutor:
         except Exception:
             return False
     
+    def _classify_columns(self, columns) -> str:
+        """Data type for documents built from rows with these columns"""
+        columns = set(columns)
+        if "employee_id" in columns or "name" in columns:
+            return "employee"
+        for required, data_type in _DATA_TYPE_RULES:
+            if required <= columns:
+                return data_type
+        return "generic_sql"
+    
     async def ingest_from_postgres_to_haystack(self, query: str, user_role: str = None) -> List[Document]:
         """
         Query PostgreSQL and convert results to Haystack documents
@@ -124,33 +163,20 @@ class SQLExecutor:
         try:
             # Execute query and get results
             async with self._pool.acquire() as conn:
-                result = await conn.fetch(query)
-                rows = [dict(row) for row in result]
-                
+                rows = await conn.fetch(query)
+            
+            # Data type based on the result's columns, the same for every row
+            data_type = self._classify_columns(rows[0].keys()) if rows else None
+            
             # Convert to Haystack documents
             documents = []
             
             for idx, row in enumerate(rows):
                 # Create structured content from row data
-                content_parts = []
-                meta_data = {"source": "postgres", "row_id": idx}
-                
-                for key, value in row.items():
-                    if value is not None:
-                        content_parts.append(f"{key}: {value}")
-                        meta_data[key] = str(value)
+                values = {key: str(value) for key, value in row.items() if value is not None}
+                content = "\n".join(f"{key}: {value}" for key, value in values.items())
                 
-                content = "\n".join(content_parts)
-                
-                # Set data type based on keys in the row
-                if "employee_id" in row or "name" in row:
-                    meta_data["data_type"] = "employee"
-                elif "date" in row and "position" in row:
-                    meta_data["data_type"] = "shift"
-                elif "date" in row and "labor_cost" in row:
-                    meta_data["data_type"] = "labor_cost"
-                else:
-                    meta_data["data_type"] = "generic_sql"
+                meta_data = {"source": "postgres", "row_id": idx, **values, "data_type": data_type}
                 
                 # Add document
                 doc = Document(content=content, meta=meta_data)
@@ -171,44 +197,53 @@ class SQLExecutor:
             await self.connect()
         
         try:
-            # Read data from file based on extension
+            # Read data from file based on extension, as batches of row tuples
             ext = file_path.split('.')[-1].lower()
             if ext == 'json':
                 df = pd.read_json(file_path)
+                columns = list(df.columns) if len(df) else []
+                df = df.astype(object).where(df.notna(), None)
+                batches = [_text_rows(df.itertuples(index=False, name=None))]
             elif ext in ('parquet', 'pq'):
-                df = pd.read_parquet(file_path)
+                # Row groups are read a batch at a time, so the whole file is never in memory
+                parquet_file = pq.ParquetFile(file_path)
+                columns = parquet_file.schema_arrow.names if parquet_file.metadata.num_rows else []
+                batches = (
+                    _text_rows(zip(*(column.to_pylist() for column in batch.columns)))
+                    for batch in parquet_file.iter_batches(batch_size=self.file_batch_size)
+                )
             else:
                 logger.error(f"Unsupported file format: {ext}")
                 return 0
-                
-            # Convert dataframe to records
-            records = df.to_dict(orient='records')
-            
-            # Get column names and types
-            columns = list(records[0].keys()) if records else []
             
             if not columns:
                 logger.error("No columns found in file")
                 return 0
             
             # Create table if not exists (simple approach)
-            create_table_sql = f"CREATE TABLE IF NOT EXISTS {table_name} ("
-            create_table_sql += ", ".join([f"{col} TEXT" for col in columns])
+            # Identifiers are quoted as COPY quotes them, so both name the same table and columns
+            quoted_table = _quote_ident(table_name)
+            quoted_columns = ", ".join(_quote_ident(col) for col in columns)
+            create_table_sql = f"CREATE TABLE IF NOT EXISTS {quoted_table} ("
+            create_table_sql += ", ".join([f"{_quote_ident(col)} TEXT" for col in columns])
             create_table_sql += ")"
             
             # Generate insert SQL
-            insert_sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(['$' + str(i+1) for i in range(len(columns))])})"
+            insert_sql = f"INSERT INTO {quoted_table} ({quoted_columns}) VALUES ({', '.join(['$' + str(i+1) for i in range(len(columns))])})"
             
             # Execute SQL
             count = 0
             async with self._pool.acquire() as conn:
                 await conn.execute(create_table_sql)
                 
-                # Insert records
-                for record in records:
-                    values = [record.get(col) for col in columns]
-                    await conn.execute(insert_sql, *values)
-                    count += 1
+                # Stream each batch in one COPY, or one pipelined batch of inserts if COPY is refused
+                for rows in batches:
+                    try:
+                        await conn.copy_records_to_table(table_name, records=rows, columns=columns)
+                    except (asyncpg.PostgresError, asyncpg.exceptions.DataError) as e:
+                        logger.warning(f"COPY into {table_name} failed, inserting instead: {str(e)}")
+                        await conn.executemany(insert_sql, rows)
+                    count += len(rows)
             
             logger.info(f"Ingested {count} records into {table_name}")
             return count
@@ -0,0 +1,11 @@
+"""
+Shared pytest setup for HRAsk tests - imports the services from the project root
+"""
+import os
+import sys
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Sample CSV files shipped with the UI
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'redis2'))
@@ -3,39 +3,50 @@ Test script to listen for responses from Redis queue
 """
 import os
 import sys
-import json
+import math
+import orjson
 import time
-import redis
 import argparse
 from datetime import datetime
 
 # Add parent directory to path to import modules
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+# Built once at import, so parse_args only parses
+_PARSER = argparse.ArgumentParser(description='Listen for responses from Redis queue')
+_PARSER.add_argument('--query-id', '-q', type=str, default=None,
+                    help='Query ID to filter (if omitted, listen for all responses)')
+_PARSER.add_argument('--timeout', '-t', type=int, default=60,
+                    help='Timeout in seconds (0 for indefinite)')
+_PARSER.add_argument('--host', type=str, default='localhost',
+                    help='Redis host')
+_PARSER.add_argument('--port', type=int, default=6379,
+                    help='Redis port')
+
 def parse_args():
     """Parse command line arguments"""
-    parser = argparse.ArgumentParser(description='Listen for responses from Redis queue')
-    parser.add_argument('--query-id', '-q', type=str, default=None,
-                       help='Query ID to filter (if omitted, listen for all responses)')
-    parser.add_argument('--timeout', '-t', type=int, default=60,
-                       help='Timeout in seconds (0 for indefinite)')
-    parser.add_argument('--host', type=str, default='localhost',
-                       help='Redis host')
-    parser.add_argument('--port', type=int, default=6379,
-                       help='Redis port')
-    
-    return parser.parse_args()
+    return _PARSER.parse_args()
+
+def restore_skipped(r, skipped_name, queue_name):
+    """Put set-aside messages back at the head of the queue, in their original order"""
+    skipped = r.lrange(skipped_name, 0, -1)
+    if skipped:
+        pipe = r.pipeline(transaction=True)
+        pipe.lpush(queue_name, *reversed(skipped))
+        pipe.delete(skipped_name)
+        pipe.execute()
 
 def main():
     """Listen for responses from Redis queue"""
     args = parse_args()
     
+    # Imported after parsing, so --help does not pay for it
+    import redis
+    
     # Connect to Redis
-    r = redis.Redis(
-        host=args.host,
-        port=args.port,
-        decode_responses=True
-    )
+    # Pooled, so a dropped connection is replaced by the pool on the next command
+    pool = redis.ConnectionPool(host=args.host, port=args.port, max_connections=4)
+    r = redis.Redis(connection_pool=pool)
     
     # Check Redis connection
     try:
@@ -51,50 +62,88 @@ def main():
     if args.query_id:
         print(f"Filtering for query ID: {args.query_id}")
     
-    start_time = time.time()
-    while args.timeout == 0 or time.time() - start_time < args.timeout:
-        try:
-            # Check for messages with timeout
-            message = r.blpop(queue_name, timeout=1)
+    # Responses for other queries are set aside here, and put back at the head of the queue on exit
+    skipped_name = f"{queue_name}.skipped.{os.getpid()}"
+    
+    # The id as it appears, quoted, in any response for it; messages without it can skip the parse
+    query_id_needle = orjson.dumps(args.query_id) if args.query_id else None
+    
+    # A set-aside message waiting to be written together with the next wait
+    skip_data = None
+    
+    # Monotonic, so a wall-clock change cannot cut the wait short or stretch it
+    deadline = time.monotonic_ns() + args.timeout * 1_000_000_000 if args.timeout else 0
+    try:
+        while True:
+            # One blocking wait for whatever is left of the timeout budget, in whole
+            # seconds (0 waits indefinitely)
+            if deadline:
+                remaining_ns = deadline - time.monotonic_ns()
+                if remaining_ns <= 0:
+                    break
+                remaining = math.ceil(remaining_ns / 1_000_000_000)
+            else:
+                remaining = 0
             
-            if message:
-                queue_name, message_data = message
-                response = json.loads(message_data)
+            try:
+                if skip_data is None:
+                    message = r.blpop(queue_name, timeout=remaining)
+                else:
+                    # Set the last mismatch aside and wait again in one round trip
+                    pipe = r.pipeline(transaction=False)
+                    pipe.rpush(skipped_name, skip_data)
+                    pipe.blpop(queue_name, timeout=remaining)
+                    _, message = pipe.execute()
+                    skip_data = None
                 
-                # Filter by query ID if specified
-                if args.query_id and response.get('query_id') != args.query_id:
-                    # Put the message back in the queue
-                    r.rpush(queue_name, message_data)
-                    continue
-                
-                # Print the response
-                print("\n" + "="*50)
-                print(f"Received response for query ID: {response.get('query_id')}")
-                print(f"Success: {response.get('success', False)}")
-                print(f"Documents found: {response.get('documents_found', 0)}")
-                print("-"*50)
-                print("Response:")
-                print(response.get('response', 'No response'))
-                
-                # Print debug info if available
-                if 'debug' in response:
-                    print("-"*50)
-                    print("Debug info:")
-                    for key, value in response['debug'].items():
-                        print(f"  {key}: {value}")
-                
-                print("="*50 + "\n")
-                
-                # If we found the specific query ID, we're done
-                if args.query_id:
-                    return 0
+                if message:
+                    # Raw bytes straight to orjson, no intermediate str
+                    _, message_data = message
+                    if query_id_needle and query_id_needle not in message_data:
+                        skip_data = message_data
+                        continue
+                    response = orjson.loads(message_data)
+                    
+                    # Filter by query ID if specified
+                    if args.query_id and response.get('query_id') != args.query_id:
+                        # Set the message aside so it isn't popped again on the next wait
+                        skip_data = message_data
+                        continue
+                    
+                    # Print the response, formatted first and written in one call
+                    lines = [
+                        "\n" + "="*50,
+                        f"Received response for query ID: {response.get('query_id')}",
+                        f"Success: {response.get('success', False)}",
+                        f"Documents found: {response.get('documents_found', 0)}",
+                        "-"*50,
+                        "Response:",
+                        str(response.get('response', 'No response'))
+                    ]
+                    
+                    # Print debug info if available
+                    if 'debug' in response:
+                        lines.append("-"*50)
+                        lines.append("Debug info:")
+                        lines.extend(f"  {key}: {value}" for key, value in response['debug'].items())
+                    
+                    lines.append("="*50 + "\n")
+                    print("\n".join(lines), flush=True)
                     
-        except KeyboardInterrupt:
-            print("\nListening stopped by user")
-            return 0
-        except Exception as e:
-            print(f"Error: {str(e)}")
-            continue
+                    # If we found the specific query ID, we're done
+                    if args.query_id:
+                        return 0
+                        
+            except KeyboardInterrupt:
+                print("\nListening stopped by user")
+                return 0
+            except Exception as e:
+                print(f"Error: {str(e)}")
+                continue
+    finally:
+        if skip_data is not None:
+            r.rpush(skipped_name, skip_data)
+        restore_skipped(r, skipped_name, queue_name)
     
     if args.timeout > 0:
         print(f"\nTimeout reached after {args.timeout} seconds")
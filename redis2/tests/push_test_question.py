@@ -3,65 +3,63 @@ Test script to push a sample question to Redis queue
 """
 import os
 import sys
-import json
-import uuid
-import redis
+import orjson
 import argparse
 from datetime import datetime
 
 # Add parent directory to path to import modules
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+# Messages sent per pipeline in --count mode, to bound memory
+PUSH_CHUNK_SIZE = 1000
+
+# Built once at import, so parse_args only parses
+_PARSER = argparse.ArgumentParser(description='Push a test question to Redis queue')
+_PARSER.add_argument('--query', '-q', type=str, required=True, 
+                    help='Question to ask')
+_PARSER.add_argument('--role', '-r', type=str, default='employee',
+                    choices=['employee', 'supervisor', 'manager', 'admin'],
+                    help='User role')
+_PARSER.add_argument('--user-id', '-u', type=str, default='test_user',
+                    help='User ID')
+_PARSER.add_argument('--account-id', '-a', type=str, default='acct001',
+                    help='Account ID')
+_PARSER.add_argument('--location-ids', '-l', type=str, default='loc001',
+                    help='Location IDs (comma-separated)')
+_PARSER.add_argument('--model', '-m', type=str, default=None,
+                    help='Model name (default: use system default)')
+_PARSER.add_argument('--top-k', '-k', type=int, default=5,
+                    help='Number of documents to retrieve')
+_PARSER.add_argument('--host', type=str, default='localhost',
+                    help='Redis host')
+_PARSER.add_argument('--port', type=int, default=6379,
+                    help='Redis port')
+_PARSER.add_argument('--count', '-n', type=int, default=1,
+                    help='Number of copies of the question to push, each with its own query ID')
+
 def parse_args():
     """Parse command line arguments"""
-    parser = argparse.ArgumentParser(description='Push a test question to Redis queue')
-    parser.add_argument('--query', '-q', type=str, required=True, 
-                       help='Question to ask')
-    parser.add_argument('--role', '-r', type=str, default='employee',
-                       choices=['employee', 'supervisor', 'manager', 'admin'],
-                       help='User role')
-    parser.add_argument('--user-id', '-u', type=str, default='test_user',
-                       help='User ID')
-    parser.add_argument('--account-id', '-a', type=str, default='acct001',
-                       help='Account ID')
-    parser.add_argument('--location-ids', '-l', type=str, default='loc001',
-                       help='Location IDs (comma-separated)')
-    parser.add_argument('--model', '-m', type=str, default=None,
-                       help='Model name (default: use system default)')
-    parser.add_argument('--top-k', '-k', type=int, default=5,
-                       help='Number of documents to retrieve')
-    parser.add_argument('--host', type=str, default='localhost',
-                       help='Redis host')
-    parser.add_argument('--port', type=int, default=6379,
-                       help='Redis port')
-    
-    return parser.parse_args()
+    return _PARSER.parse_args()
 
 def main():
     """Push a test question to Redis queue"""
     args = parse_args()
     
+    # Imported after parsing, so --help does not pay for them
+    import uuid
+    import redis
+    
     # Connect to Redis
     r = redis.Redis(
         host=args.host,
-        port=args.port,
-        decode_responses=True
+        port=args.port
     )
     
-    # Check Redis connection
-    try:
-        r.ping()
-        print(f"Connected to Redis at {args.host}:{args.port}")
-    except redis.ConnectionError:
-        print(f"Failed to connect to Redis at {args.host}:{args.port}")
-        return 1
-    
     # Split location IDs
     location_ids = [loc.strip() for loc in args.location_ids.split(',') if loc.strip()]
     
-    # Create query data
-    query_data = {
-        "query_id": str(uuid.uuid4()),
+    # Create query data; every copy shares it apart from the query ID
+    base_query = {
         "query": args.query,
         "user_role": args.role,
         "user_id": args.user_id,
@@ -69,16 +67,33 @@ def main():
         "location_ids": location_ids,
         "model": args.model,
         "top_k": args.top_k,
-        "timestamp": datetime.now().isoformat()
+        "timestamp": datetime.now()
     }
+    query_ids = [uuid.uuid4() for _ in range(max(args.count, 1))]
     
-    # Push to Redis queue
-    queue_name = "hrask.ask.queue"
+    # Check Redis connection and add to the ask stream, one round trip per chunk of messages
+    queue_name = "hrask.ask.stream"
     try:
-        r.rpush(queue_name, json.dumps(query_data))
-        print(f"Query pushed to {queue_name}")
-        print(f"Query ID: {query_data['query_id']}")
-        print(f"Use this ID with listen_response.py to get the response")
+        for start in range(0, len(query_ids), PUSH_CHUNK_SIZE):
+            pipe = r.pipeline(transaction=False)
+            if start == 0:
+                pipe.ping()
+            for query_id in query_ids[start:start + PUSH_CHUNK_SIZE]:
+                query_data = {"query_id": query_id, **base_query}
+                pipe.xadd(queue_name, {"data": orjson.dumps(query_data)}, maxlen=100000, approximate=True)
+            pipe.execute()
+        print(f"Connected to Redis at {args.host}:{args.port}")
+        if len(query_ids) == 1:
+            print(f"Query pushed to {queue_name}")
+            print(f"Query ID: {query_ids[0]}")
+            print(f"Use this ID with listen_response.py to get the response")
+        else:
+            print(f"{len(query_ids)} queries pushed to {queue_name}")
+            print(f"First query ID: {query_ids[0]}")
+            print(f"Last query ID: {query_ids[-1]}")
+    except redis.ConnectionError:
+        print(f"Failed to connect to Redis at {args.host}:{args.port}")
+        return 1
     except Exception as e:
         print(f"Error pushing query to Redis: {str(e)}")
         return 1
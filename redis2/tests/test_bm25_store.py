@@ -0,0 +1,69 @@
+"""
+BM25 store tests for HRAsk system - indexed retrieval against InMemoryDocumentStore on the sample CSVs
+"""
+import os
+
+import pandas as pd
+import pytest
+from haystack import Document
+from haystack.document_stores.in_memory import InMemoryDocumentStore
+from haystack.document_stores.types import DuplicatePolicy
+
+from bm25_store import BM25DocumentStore, document_id
+from conftest import DATA_DIR
+
+QUERIES = ["Shift Lead FOH", "sales variance", "Line Cook BOH attendance", "Allison Milam"]
+FILTERS = {"field": "meta.source", "operator": "==", "value": "file1.csv"}
+
+def csv_documents(csv_file):
+    df = pd.read_csv(os.path.join(DATA_DIR, csv_file)).dropna(how="all")
+    docs = []
+    for idx, row in df.astype(str).iterrows():
+        content = "\n".join(f"{col}: {val}" for col, val in row.items())
+        docs.append(Document(id=document_id(csv_file, idx, content), content=content,
+                             meta={"source": csv_file, "row_id": int(idx)}))
+    return docs
+
+@pytest.fixture
+def store():
+    store = BM25DocumentStore()
+    for csv_file in ("file1.csv", "dailySalesBreakdown.csv"):
+        store.write_documents(csv_documents(csv_file))
+    return store
+
+def assert_matches_base(store, filters=None):
+    for query in QUERIES:
+        expected = InMemoryDocumentStore.bm25_retrieval(store, query, filters=filters, top_k=10)
+        docs = store.bm25_retrieval(query, filters=filters, top_k=10)
+        assert [doc.id for doc in docs] == [doc.id for doc in expected]
+        assert [doc.score for doc in docs] == pytest.approx([doc.score for doc in expected])
+
+def test_matches_base_store(store):
+    assert_matches_base(store)
+
+def test_matches_base_store_with_filters(store):
+    assert_matches_base(store, FILTERS)
+
+def test_matches_base_store_after_delete_and_overwrite(store):
+    doc_ids = list(store.storage)
+    store.delete_documents(doc_ids[::3])
+    overwritten = [Document(id=doc.id, content=doc.content + "\nNote: overtime", meta=doc.meta)
+                   for doc in list(store.storage.values())[::5]]
+    store.write_documents(overwritten, policy=DuplicatePolicy.OVERWRITE)
+    assert_matches_base(store)
+    assert_matches_base(store, FILTERS)
+
+def test_deleted_rows_are_compacted(store):
+    doc_ids = list(store.storage)
+    store.delete_documents(doc_ids[:len(doc_ids) * 3 // 4])
+    assert len(store._row_ids) <= 2 * len(store.storage)
+    assert_matches_base(store)
+
+def test_matches_base_store_after_load_index(store, tmp_path):
+    path = str(tmp_path / "index.npz")
+    store.delete_documents(list(store.storage)[::4])
+    store.save_index(path)
+    loaded = BM25DocumentStore()
+    assert loaded.load_index(path) == len(store.storage)
+    assert_matches_base(loaded)
+    assert_matches_base(loaded, FILTERS)
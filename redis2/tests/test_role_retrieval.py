@@ -0,0 +1,58 @@
+"""
+Role filter tests for HRAsk system - retrieval through HaystackWrapper with RoleValidator filters
+"""
+import asyncio
+import os
+
+import pytest
+
+from conftest import DATA_DIR
+from haystack_wrapper import HaystackWrapper
+from role_validator import RoleValidator
+
+QUERY = "Shift Lead FOH sales"
+
+@pytest.fixture(scope="module")
+def wrapper():
+    wrapper = HaystackWrapper()
+    for csv_file in ("file1.csv", "dailySalesBreakdown.csv"):
+        asyncio.run(wrapper.ingest_csv(os.path.join(DATA_DIR, csv_file)))
+    return wrapper
+
+def retrieve(wrapper, **query_data):
+    validator = RoleValidator()
+    user = validator.validate_role(query_data)
+    filters = validator.create_filters(user)
+    docs = asyncio.run(wrapper.retrieve_documents(QUERY, filters=filters, top_k=20))
+    return user, docs
+
+def is_public(doc):
+    return doc.meta.get("data_type") == "sales_breakdown"
+
+def test_employee_sees_own_rows_and_sales(wrapper):
+    _, docs = retrieve(wrapper, user_role="employee", user_id="Allison Milam")
+    assert docs
+    assert all(doc.meta.get("employee_key") == "allison milam" or is_public(doc) for doc in docs)
+    assert any(doc.meta.get("employee_key") == "allison milam" for doc in docs)
+
+def test_employee_without_rows_sees_only_sales(wrapper):
+    _, docs = retrieve(wrapper, user_role="employee", user_id="nobody")
+    assert docs
+    assert all(is_public(doc) for doc in docs)
+
+def test_supervisor_sees_team_rows_and_sales(wrapper):
+    user, docs = retrieve(wrapper, user_role="supervisor", user_id="sup001")
+    assert docs
+    assert all(doc.meta.get("employee_key") in user.team_keys or is_public(doc) for doc in docs)
+
+def test_manager_sees_own_and_unlocated_rows(wrapper):
+    user, docs = retrieve(wrapper, user_role="manager", user_id="mgr001", location_ids=["loc001"])
+    assert docs
+    assert all(not doc.meta.get("location") or doc.meta.get("location_key") in user.location_keys or is_public(doc)
+               for doc in docs)
+    assert any(doc.meta.get("data_type") == "employee_schedule" for doc in docs)
+
+def test_admin_is_unfiltered(wrapper):
+    user, docs = retrieve(wrapper, user_role="admin", user_id="admin001")
+    assert RoleValidator().create_filters(user) == {}
+    assert len({doc.meta.get("employee_key") for doc in docs if doc.meta.get("employee_key")}) > 1